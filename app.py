@@ -1,14 +1,45 @@
-from flask import Flask, send_from_directory, request, jsonify, send_file
+from flask import Flask, Response, g, has_request_context, send_file, send_from_directory, request, jsonify, stream_with_context
+import atexit
+import cProfile
+import gzip
+import hashlib
+import io
 import json
+import math
+import mimetypes
 import os
+import pstats
+import queue
+import random
+import re
 from datetime import datetime
 import uuid
 import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from bisect import bisect_right
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from werkzeug.utils import safe_join
+
+try:
+    import fcntl  # POSIX only; serializes appends and legacy upgrades across worker processes
+except ImportError:
+    fcntl = None
+
+try:
+    import brotli  # optional; gzip is always offered
+except ImportError:
+    brotli = None
 
 # Load .env if present to make development easier without committing secrets
+import importlib
+
 try:
     # use dynamic import to avoid static import errors when python-dotenv isn't installed
-    import importlib
     dotenv = importlib.import_module('dotenv')
     load_dotenv = getattr(dotenv, 'load_dotenv', None)
     if callable(load_dotenv):
@@ -19,53 +50,339 @@ except Exception:
 
 app = Flask(__name__, static_folder='.', static_url_path='')
 
-CHAT_LOG_FILE = 'chat_logs.json'
+# Metrics: per-process histograms and counters, exported at /api/metrics in Prometheus
+# text format. timed() records a stage both in its histogram and, inside a request, in
+# g.stages so slow requests can be logged with a per-stage breakdown.
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_HELP = {
+    'mmec_request_seconds': 'HTTP request latency by endpoint',
+    'mmec_stage_seconds': 'Query pipeline stage latency',
+    'mmec_provider_seconds': 'AI provider call latency by outcome',
+    'mmec_storage_seconds': 'History and chat log storage operation latency',
+    'mmec_answers_total': 'Answers returned by source',
+    'mmec_slow_requests_total': 'Requests slower than SLOW_REQUEST_MS',
+    'mmec_ai_cache_hits_total': 'AI response cache hits',
+    'mmec_ai_cache_misses_total': 'AI response cache misses',
+    'mmec_ai_singleflight_calls_total': 'Provider calls made by single-flight leaders',
+    'mmec_ai_singleflight_coalesced_total': 'Requests that shared an in-flight provider call',
+}
+
+class Metrics:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.hists = {}     # (name, labels) -> [bucket counts..., sum, count]
+        self.counters = {}  # (name, labels) -> value
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timed(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            self.observe(name, dt, **labels)
+            if has_request_context() and hasattr(g, 'stages'):
+                g.stages.append((labels.get('stage') or labels.get('op') or labels.get('provider') or name, dt))
+
+    def render(self, gauges=()):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+        out = []
+        with self._lock:
+            hists = sorted(self.hists.items())
+            counters = sorted(self.counters.items())
+        seen = set()
+        for (name, labels), h in hists:
+            if name not in seen:
+                seen.add(name)
+                out.append(f'# HELP {name} {METRIC_HELP.get(name, name)}')
+                out.append(f'# TYPE {name} histogram')
+            for i, bound in enumerate(self.buckets):
+                out.append(f'{name}_bucket{fmt(labels, [("le", bound)])} {h[i]}')
+            out.append(f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {h[-1]}')
+            out.append(f'{name}_sum{fmt(labels)} {h[-2]:.6f}')
+            out.append(f'{name}_count{fmt(labels)} {h[-1]}')
+        for (name, labels), v in counters:
+            if name not in seen:
+                seen.add(name)
+                out.append(f'# HELP {name} {METRIC_HELP.get(name, name)}')
+                out.append(f'# TYPE {name} counter')
+            out.append(f'{name}{fmt(labels)} {v}')
+        for name, help_text, labels, v in gauges:
+            if name not in seen:
+                seen.add(name)
+                out.append(f'# HELP {name} {help_text}')
+                out.append(f'# TYPE {name} gauge')
+            out.append(f'{name}{fmt(sorted(labels.items()))} {v}')
+        return '\n'.join(out) + '\n'
+
+METRICS = Metrics()
+
+CHAT_LOG_FILE = 'chat_logs.jsonl'
+LEGACY_CHAT_LOG_FILE = 'chat_logs.json'
 USERS_FILE = 'users.json'
 SETTINGS_FILE = os.path.join('data','settings.json')
 
-# Simple in-memory session store: token -> username
-SESSIONS = {}
-
 def _ensure_settings():
     base = os.path.dirname(SETTINGS_FILE)
     if base and not os.path.exists(base):
         os.makedirs(base, exist_ok=True)
     if not os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE,'w',encoding='utf-8') as f:
-            json.dump({'allow_external_queries': True}, f)
+        _write_json_atomic(SETTINGS_FILE, {'allow_external_queries': True})
+
+def _write_json_atomic(path, d):
+    # temp file + rename so readers (here or in other workers) never see a half-written file
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(d, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# Settings are served from an in-memory, versioned snapshot. It is replaced on
+# write_settings() and re-read only when the file's mtime changes (checked at most every
+# SETTINGS_CHECK_INTERVAL seconds), which is how changes made by other workers arrive.
+SETTINGS_CHECK_INTERVAL = float(os.getenv('SETTINGS_CHECK_INTERVAL', '1.0'))
+DEFAULT_SETTINGS = {'allow_external_queries': True}
+
+class SettingsCache:
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+        self.version = 0
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        _ensure_settings()
+        mtime = self._stat_mtime()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snap = json.load(f)
+        except Exception:
+            snap = dict(DEFAULT_SETTINGS)
+        self.snapshot = snap
+        self._mtime = mtime
+        self.version += 1
+
+    def get(self):
+        now = time.monotonic()
+        if self.snapshot is None or now - self._checked >= SETTINGS_CHECK_INTERVAL:
+            with self._lock:
+                if self.snapshot is None or self._stat_mtime() != self._mtime:
+                    self._load()
+                self._checked = now
+        return self.snapshot
+
+    def write(self, d):
+        with self._lock:
+            _ensure_settings()
+            _write_json_atomic(self.path, d)
+            self.snapshot = dict(d)
+            self._mtime = self._stat_mtime()
+            self._checked = time.monotonic()
+            self.version += 1
+
+SETTINGS = SettingsCache(SETTINGS_FILE)
 
 def read_settings():
-    _ensure_settings()
-    try:
-        with open(SETTINGS_FILE,'r',encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {'allow_external_queries': True}
+    # copy so callers can edit and pass it back to write_settings
+    return dict(SETTINGS.get())
 
 def write_settings(d):
-    _ensure_settings()
-    with open(SETTINGS_FILE,'w',encoding='utf-8') as f:
-        json.dump(d, f, indent=2)
+    SETTINGS.write(d)
 
 def is_external_allowed():
     # env var overrides file setting
     env = os.getenv('ALLOW_EXTERNAL_QUERIES')
     if env is not None:
         return str(env).lower() in ('1','true','yes')
-    s = read_settings()
-    return bool(s.get('allow_external_queries', True))
-
-# Load or initialize chat logs
-def load_logs():
-    if not os.path.exists(CHAT_LOG_FILE):
-        with open(CHAT_LOG_FILE, 'w') as f:
-            json.dump([], f, indent=2)
-    with open(CHAT_LOG_FILE, 'r') as f:
-        return json.load(f)
+    return bool(SETTINGS.get().get('allow_external_queries', True))
+
+def iter_lines_reversed(path, end=None, block=65536):
+    """Yield (offset, line_bytes) for complete lines of a file from `end` (default EOF)
+    back to the start, reading fixed-size blocks so the cost is proportional to what
+    the caller consumes rather than the file size."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # a cursor past EOF (stale, or made up) starts from the end instead of walking empty blocks
+        end = size if end is None else max(0, min(end, size))
+        pos = end
+        tail = b''
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step) + tail
+            lines = chunk.split(b'\n')
+            # first piece may be the end of a line that starts in an earlier block
+            tail = lines[0]
+            starts = []
+            off = pos + len(tail) + 1
+            for ln in lines[1:]:
+                starts.append(off)
+                off += len(ln) + 1
+            for start, ln in zip(reversed(starts), reversed(lines[1:])):
+                yield start, ln
+        if tail:
+            yield 0, tail
+
+# Chat logs: append-only JSON Lines file. A write is one O_APPEND write of one line (safe
+# across threads and worker processes); fsync is batched by count/interval and forced on
+# flush(). Reads stream the file or page backwards from a byte-offset cursor.
+LOG_FSYNC_BATCH = int(os.getenv('LOG_FSYNC_BATCH', '50'))
+LOG_FSYNC_INTERVAL = float(os.getenv('LOG_FSYNC_INTERVAL', '1.0'))
+
+@contextmanager
+def _flocked(path, mode='rb'):
+    """Open `path` holding an exclusive lock on it across worker processes (no-op without fcntl)."""
+    with open(path, mode) as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class ChatLogStore:
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._fd = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._fd is None:
+            if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+                # another worker may be converting too: whoever gets the lock first does it
+                with _flocked(self.legacy_path):
+                    if not os.path.exists(self.path):
+                        convert_legacy_logs(self.legacy_path, self.path)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            # seal a torn last line left by a crash so the next append starts cleanly
+            size = os.fstat(self._fd).st_size
+            if size:
+                with open(self.path, 'rb') as f:
+                    f.seek(size - 1)
+                    if f.read(1) != b'\n':
+                        os.write(self._fd, b'\n')
+        return self._fd
+
+    def append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            fd = self._open()
+            os.write(fd, line)
+            self._pending += 1
+            now = time.monotonic()
+            if self._pending >= LOG_FSYNC_BATCH or now - self._last_sync >= LOG_FSYNC_INTERVAL:
+                os.fsync(fd)
+                self._pending = 0
+                self._last_sync = now
+
+    def flush(self):
+        with self._lock:
+            if self._fd is not None and self._pending:
+                os.fsync(self._fd)
+                self._pending = 0
+                self._last_sync = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._open()
+            os.truncate(self.path, 0)
+            self._pending = 0
+
+    def iter_raw(self):
+        """Yield each complete log line (already JSON text), oldest first."""
+        with self._lock:
+            self._open()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for ln in f:
+                # a line without its newline (or that doesn't parse) is a torn write; skip it
+                if not ln.endswith('\n') or not ln.strip():
+                    continue
+                try:
+                    json.loads(ln)
+                except ValueError:
+                    continue
+                yield ln.rstrip('\n')
 
-def save_logs(logs):
-    with open(CHAT_LOG_FILE, 'w') as f:
-        json.dump(logs, f, indent=2)
+    def page(self, limit, before=None):
+        """Return (entries oldest-first, next_before) for the `limit` entries that end
+        before byte offset `before` (default: newest). next_before is None at the start."""
+        with self._lock:
+            self._open()
+        out = []
+        oldest = None
+        lines = iter_lines_reversed(self.path, before)
+        # the first piece is whatever follows the last newline: empty, or a torn write
+        next(lines, None)
+        for off, ln in lines:
+            if not ln.strip():
+                continue
+            try:
+                out.append(json.loads(ln))
+            except Exception:
+                continue
+            oldest = off
+            if len(out) >= limit:
+                break
+        out.reverse()
+        next_before = oldest if (oldest and len(out) >= limit) else None
+        return out, next_before
+
+def convert_legacy_logs(src_path, dest_path):
+    """One-time upgrade of a chat_logs.json array into the JSON Lines log file."""
+    try:
+        with open(src_path, 'r', encoding='utf-8') as f:
+            logs = json.load(f)
+    except Exception as e:
+        print('Failed to read legacy logs', src_path, e)
+        return 0
+    tmp = f'{dest_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for entry in logs:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, dest_path)
+    return len(logs)
+
+LOGS = ChatLogStore(CHAT_LOG_FILE, LEGACY_CHAT_LOG_FILE)
+atexit.register(LOGS.flush)
 
 # Load users (simple JSON with plain text passwords for prototype)
 def load_users():
@@ -81,148 +398,1323 @@ def load_users():
     with open(USERS_FILE, 'r') as f:
         return json.load(f)
 
+# Offline FAQ (data/faq.json) compiled into an Aho-Corasick automaton so matching is a
+# single pass over the message regardless of how many triggers there are.
+FAQ_FILE = os.path.join('data', 'faq.json')
+
+class FaqMatcher:
+    """Multi-pattern matcher over the triggers of a list of {triggers, answer} entries.
+
+    match() keeps the old semantics (a trigger appears in the message, or the whole
+    message is a fragment of a trigger) but returns every matching entry with a score
+    in [0, 1]: the share of the message covered by the trigger (or vice versa).
+    """
+
+    SEP = '\x00'
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        triggers = []
+        for idx, entry in enumerate(self.entries):
+            for tr in entry.get('triggers', []):
+                tr = (tr or '').strip().lower()
+                if tr:
+                    triggers.append((tr, idx))
+                    self._add(tr, idx)
+        self._build()
+        # Reverse case (message inside a trigger): one C-level str.find over all triggers
+        self._joined = self.SEP.join(tr for tr, _ in triggers)
+        self._starts = []
+        pos = 0
+        for tr, _ in triggers:
+            self._starts.append(pos)
+            pos += len(tr) + 1
+        self._triggers = triggers
+
+    def _add(self, trigger, idx):
+        state = 0
+        for ch in trigger:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((idx, len(trigger)))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def match(self, msg_lower):
+        """Return [(entry, score), ...] for every matching entry, best score first
+        (ties keep file order)."""
+        n = len(msg_lower)
+        if not n:
+            # an empty message is a fragment of every trigger; keep the old first-entry answer
+            return [(self.entries[0], 0.0)] if self.entries else []
+        scores = {}
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in msg_lower:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for idx, length in out[state]:
+                score = length / n
+                if score > scores.get(idx, -1.0):
+                    scores[idx] = score
+        if self.SEP not in msg_lower:
+            pos = self._joined.find(msg_lower)
+            while pos != -1:
+                i = bisect_right(self._starts, pos) - 1
+                tr, idx = self._triggers[i]
+                if pos + n <= self._starts[i] + len(tr):
+                    score = n / len(tr)
+                    if score > scores.get(idx, -1.0):
+                        scores[idx] = score
+                pos = self._joined.find(msg_lower, pos + 1)
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(self.entries[idx], score) for idx, score in ranked]
+
+def load_faq():
+    try:
+        with open(FAQ_FILE, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except Exception as e:
+        print('Failed to load FAQ', FAQ_FILE, e)
+        entries = []
+    return FaqMatcher(entries)
+
+FAQ = load_faq()
+
+# College data corpus: every .json/.md file in data/college_info (the kinds the search index
+# understands; uploads may put other files there) is read and parsed once and kept in
+# memory (raw, lowercased and, for JSON, parsed + dumped forms). A refresh re-stats the
+# directory and reloads only files whose mtime or size changed; a file that fails to load
+# is not retried until it changes. Admin uploads invalidate the affected file immediately.
+COLLEGE_INFO_DIR = os.path.join('data', 'college_info')
+CORPUS_CHECK_INTERVAL = float(os.getenv('CORPUS_CHECK_INTERVAL', '1.0'))
+CORPUS_EXTENSIONS = ('.json', '.md')
+
+class CollegeCorpus:
+    def __init__(self, base):
+        self.base = base
+        self.docs = {}  # filename -> {mtime, size, text, lower, data, data_lower}
+        self.version = 0
+        self._checked = 0.0
+        self._failed = {}  # filename -> (mtime, size) of the version that failed to load
+        self._lock = threading.Lock()
+
+    def _load(self, fn, st):
+        path = os.path.join(self.base, fn)
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        doc = {'mtime': st.st_mtime, 'size': st.st_size, 'text': text, 'lower': text.lower(),
+               'data': None, 'data_lower': None}
+        if fn.endswith('.json'):
+            try:
+                doc['data'] = json.loads(text)
+                doc['data_lower'] = json.dumps(doc['data']).lower()
+            except Exception as e:
+                print('Corpus JSON parse error', fn, e)
+        return doc
+
+    def refresh(self, force=False, stale=()):
+        """Re-stat the directory (at most every CORPUS_CHECK_INTERVAL seconds unless forced)
+        and reload changed files, plus those named in `stale` (or every file if stale is
+        None). Returns True if anything changed."""
+        now = time.monotonic()
+        if not force and now - self._checked < CORPUS_CHECK_INTERVAL:
+            return False
+        with self._lock:
+            self._checked = now
+            # copy-on-write: readers keep iterating the dict they already hold
+            docs = dict(self.docs)
+            changed = False
+            seen = set()
+            try:
+                entries = list(os.scandir(self.base))
+            except FileNotFoundError:
+                entries = []
+            for e in entries:
+                if not e.is_file() or not e.name.lower().endswith(CORPUS_EXTENSIONS):
+                    continue
+                seen.add(e.name)
+                st = e.stat()
+                forced = stale is None or e.name in stale
+                old = docs.get(e.name)
+                if old and old['mtime'] == st.st_mtime and old['size'] == st.st_size and not forced:
+                    continue
+                if self._failed.get(e.name) == (st.st_mtime, st.st_size) and not forced:
+                    continue
+                try:
+                    docs[e.name] = self._load(e.name, st)
+                    self._failed.pop(e.name, None)
+                    changed = True
+                except Exception as ex:
+                    print('Corpus load error', e.name, ex)
+                    self._failed[e.name] = (st.st_mtime, st.st_size)
+            for fn in list(docs):
+                if fn not in seen:
+                    del docs[fn]
+                    changed = True
+            if changed:
+                self.docs = docs
+                self.version += 1
+            return changed
+
+    def invalidate(self, fn=None):
+        """Reload one file (or everything) right away. Readers keep the previous version
+        of the file until the new one is published."""
+        self.refresh(force=True, stale=None if fn is None else (fn,))
+
+    def get(self, fn):
+        self.refresh()
+        return self.docs.get(fn)
+
+    def snapshot(self):
+        self.refresh()
+        return self.docs
+
+CORPUS = CollegeCorpus(COLLEGE_INFO_DIR)
+
+# Ranked retrieval over the corpus: an inverted index of info.md lines/paragraphs and every
+# JSON leaf (path + value), scored with BM25. Rebuilt whenever the corpus version moves.
+STOPWORDS = frozenset("""a an and any are as at be by can do does for from give has have how i in
+is it me my of on or please show tell that the there this to was what when where which who
+with you your about list details detail info information college mmec maratha mandal""".split())
+
+# common abbreviations students use -> extra query terms that appear in the data files
+QUERY_SYNONYMS = {
+    'cse': ['computer', 'science'],
+    'cs': ['cse', 'computer', 'science'],
+    'ece': ['electronic', 'communication'],
+    'mech': ['mechanical'],
+    'ai': ['artificial', 'intelligence', 'robotic'],
+    'hod': ['head'],
+    'sem': ['semester'],
+}
+
+def _stem(tok):
+    if len(tok) > 3 and tok.endswith('s') and not tok.endswith('ss'):
+        return tok[:-1]
+    return tok
+
+def tokenize(text):
+    return [_stem(t) for t in re.findall(r'[a-z0-9]+', (text or '').lower())]
+
+def _humanize(key):
+    return str(key).replace('_', ' ').strip().capitalize() if str(key).islower() else str(key).replace('_', ' ')
+
+def _json_leaves(node, path):
+    """Yield (path, value_text) for every scalar leaf; lists of scalars become one leaf."""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            yield from _json_leaves(v, path + [k])
+    elif isinstance(node, list):
+        if all(not isinstance(v, (dict, list)) for v in node):
+            yield path, ', '.join(str(v) for v in node)
+        else:
+            for i, v in enumerate(node):
+                yield from _json_leaves(v, path + [str(i)])
+    elif node is not None:
+        yield path, str(node)
+
+def _md_sections(text):
+    """Split markdown into (context, body) docs: bullet lines carry their paragraph heading."""
+    for para in re.split(r'\n\s*\n', text):
+        lines = [ln.strip() for ln in para.strip().splitlines() if ln.strip()]
+        if not lines:
+            continue
+        bullets = [ln for ln in lines[1:] if ln.startswith(('-', '*', '•'))]
+        if bullets:
+            for ln in bullets:
+                yield lines[0], ln.lstrip('-*• ').strip()
+        else:
+            yield '', ' '.join(lines)
+
+class IndexSegment:
+    """The indexed documents of one corpus file. Segments are immutable and keyed on the
+    corpus doc they were built from, so a new index generation reuses every segment whose
+    file didn't change and only tokenizes the file that did."""
+
+    def __init__(self, fn, doc):
+        self.source = doc
+        self.docs = []       # [{file, label, text, len}]
+        self.postings = {}   # term -> [(local_id, tf)]
+        if fn.endswith('.md'):
+            for ctx, body in _md_sections(doc['text']):
+                self._add(fn, ctx, body, ctx + ' ' + body)
+        elif doc.get('data') is not None:
+            stem = os.path.splitext(fn)[0]
+            for path, value in _json_leaves(doc['data'], [stem]):
+                label = ' > '.join(_humanize(p) for p in path)
+                self._add(fn, label, value, ' '.join(str(p) for p in path) + ' ' + value)
+        self.total_len = sum(d['len'] for d in self.docs)
+
+    def _add(self, fn, label, text, indexed):
+        toks = tokenize(indexed)
+        if not toks:
+            return
+        doc_id = len(self.docs)
+        self.docs.append({'file': fn, 'label': label, 'text': text, 'len': len(toks)})
+        tf = {}
+        for t in toks:
+            tf[t] = tf.get(t, 0) + 1
+        for t, c in tf.items():
+            self.postings.setdefault(t, []).append((doc_id, c))
+
+class CollegeIndex:
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, docs, version=0, previous=None):
+        self.version = version
+        self.segments = []
+        self.rebuilt = []    # files tokenized for this generation
+        reuse = {id(s.source): s for s in previous.segments} if previous else {}
+        for fn in sorted(docs):
+            seg = reuse.get(id(docs[fn]))
+            if seg is None or seg.source is not docs[fn]:
+                seg = IndexSegment(fn, docs[fn])
+                self.rebuilt.append(fn)
+            self.segments.append(seg)
+        n = sum(len(s.docs) for s in self.segments) or 1
+        self.avgdl = sum(s.total_len for s in self.segments) / n
+        df = {}
+        for s in self.segments:
+            for t, p in s.postings.items():
+                df[t] = df.get(t, 0) + len(p)
+        self.idf = {t: math.log(1 + (n - c + 0.5) / (c + 0.5)) for t, c in df.items()}
+
+    def search(self, query, k=3, min_coverage=0.6, strict_terms=3):
+        """Return up to k (score, doc) pairs, ranked by query terms covered then BM25.
+        A doc must contain at least min_coverage of the distinct query terms so stray
+        word overlaps don't answer; queries of up to `strict_terms` terms must be covered
+        completely, since one missing word there is the topic ("how many students in
+        cse" is not answered by a CSE topper named "Student A")."""
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t not in STOPWORDS]
+        if not terms:
+            return []
+        expanded = {}
+        for t in terms:
+            expanded[t] = t
+            for syn in QUERY_SYNONYMS.get(t, []):
+                expanded.setdefault(_stem(syn), t)
+        # per (doc, query term) keep the best of the term and its synonyms, so an
+        # abbreviation expansion can't outweigh a direct hit
+        parts = {}
+        k1, b, avgdl = self.K1, self.B, self.avgdl or 1.0
+        for term, origin in expanded.items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for si, seg in enumerate(self.segments):
+                for doc_id, tf in seg.postings.get(term, ()):
+                    dl = seg.docs[doc_id]['len']
+                    s = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+                    per_doc = parts.setdefault((si, doc_id), {})
+                    if s > per_doc.get(origin, 0.0):
+                        per_doc[origin] = s
+        need = max(1, math.ceil(len(terms) * min_coverage))
+        if len(terms) <= strict_terms:
+            need = len(terms)
+        scored = [(len(p), sum(p.values()), d) for d, p in parts.items() if len(p) >= need]
+        scored.sort(key=lambda x: (-x[0], -x[1]))
+        return [(score, self.segments[si].docs[d]) for _, score, (si, d) in scored[:k]]
+
+# The current index generation. Readers take the reference without locking; when the corpus
+# moves, one thread builds the next generation (reusing unchanged segments) and swaps it in
+# while the others keep answering from the previous one.
+_COLLEGE_INDEX = None
+_COLLEGE_INDEX_LOCK = threading.Lock()
+
+def get_college_index(wait=False):
+    global _COLLEGE_INDEX
+    docs = CORPUS.snapshot()
+    idx = _COLLEGE_INDEX
+    if idx is None or idx.version != CORPUS.version:
+        if not _COLLEGE_INDEX_LOCK.acquire(blocking=wait or idx is None):
+            return idx
+        try:
+            idx = _COLLEGE_INDEX
+            version = CORPUS.version
+            docs = CORPUS.docs
+            if idx is None or idx.version != version:
+                idx = CollegeIndex(docs, version, previous=idx)
+                _COLLEGE_INDEX = idx
+        finally:
+            _COLLEGE_INDEX_LOCK.release()
+    return idx
+
+def search_college_files(query_lower, min_coverage=0.6, strict_terms=3):
+    results = get_college_index().search(query_lower, min_coverage=min_coverage, strict_terms=strict_terms)
+    if not results:
+        return None
+    _, doc = results[0]
+    text = doc['text']
+    if len(text) > 400:
+        text = text[:390].rsplit(' ', 1)[0] + '...'
+    if doc['file'].endswith('.md'):
+        return f"{doc['label']} {text}".strip() if doc['label'] else text
+    return f"{doc['label']}: {text}"
+
+# Structured answers: timetable, attendance, results and fee questions are resolved straight
+# from the parsed JSON tables. The tables are re-indexed (department/semester/day/date/year
+# lookups plus a department alias map) whenever the corpus version moves; a question is then
+# an intent keyword + entity scan and a dict lookup filled into a sentence template.
+DAY_NAMES = {'mon': 'Monday', 'tue': 'Tuesday', 'wed': 'Wednesday', 'thu': 'Thursday',
+             'fri': 'Friday', 'sat': 'Saturday', 'sun': 'Sunday'}
+DAY_ALIASES = {'monday': 'mon', 'mon': 'mon', 'tuesday': 'tue', 'tue': 'tue', 'tues': 'tue',
+               'wednesday': 'wed', 'wed': 'wed', 'thursday': 'thu', 'thu': 'thu', 'thur': 'thu',
+               'thurs': 'thu', 'friday': 'fri', 'fri': 'fri', 'saturday': 'sat', 'sat': 'sat',
+               'sunday': 'sun', 'sun': 'sun'}
+# intent -> (words that name the table, words that only count when a department is named)
+STRUCTURED_INTENTS = (
+    ('timetable', ('timetable', 'time table', 'schedule'), ('classes', 'lectures', 'periods', 'subjects')),
+    ('attendance', ('attendance',), ()),
+    ('results', ('result', 'topper'), ('average', 'avg', 'marks')),
+    ('fees', ('fee', 'tuition', 'deposit', 'quota'), ('cost', 'how much')),
+)
+SEMESTER_RE = re.compile(r'\b(\d)\s*(?:st|nd|rd|th)?\s*sem(?:ester)?\b|\bsem(?:ester)?\s*(\d)\b')
+ISO_DATE_RE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+DMY_DATE_RE = re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b')
+YEAR_RE = re.compile(r'\b(20\d\d)\b')
+FEE_WORDS = frozenset(('fee', 'fees', 'cost', 'tuition', 'per', 'year', 'much', 'how', 'charge', 'charges'))
+
+def _sem_number(key):
+    m = re.search(r'\d+', str(key))
+    return int(m.group()) if m else None
+
+def _ordinal(n):
+    suffix = 'th' if 10 <= n % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return f'{n}{suffix}'
+
+def _percent(v):
+    if isinstance(v, (int, float)) and 0 <= v <= 1:
+        return f'{v * 100:.0f}%'
+    return str(v)
+
+def _acronym(name):
+    return ''.join(w[0] for w in re.findall(r'[A-Za-z]+', name) if w.lower() not in ('and', 'of', 'the')).lower()
+
+class StructuredData:
+    def __init__(self, docs, version=0):
+        self.version = version
+        self.timetable = {}    # (dept, sem) -> {day: [subjects]}
+        self.attendance = {}   # dept -> {iso date: {sem: value}}
+        self.results = {}      # dept -> {year: {sem: {field: value}}}
+        self.fees = []         # [(category label, item label or None, value, tokens)]
+        self.dept_fee = {}     # dept -> management quota fee
+        self.depts = set()
+        self.aliases = {}      # phrase -> dept code
+        self._load_tables(docs)
+        self._load_fees(docs)
+        for d in self.depts:
+            self.aliases.setdefault(d.lower(), d)
+        # longest phrases first so "computer science" wins over "computer"
+        phrases = sorted((a for a in self.aliases if a not in STOPWORDS and len(a) > 1), key=len, reverse=True)
+        self.alias_re = re.compile(r'\b(' + '|'.join(map(re.escape, phrases)) + r')\b') if phrases else None
+
+    def _data(self, docs, fn):
+        doc = docs.get(fn)
+        data = doc.get('data') if doc else None
+        return data if isinstance(data, dict) else {}
+
+    def _load_tables(self, docs):
+        for dept, sems in self._data(docs, 'timetable.json').items():
+            if not isinstance(sems, dict):
+                continue
+            self.depts.add(dept)
+            for sem_key, days in sems.items():
+                sem = _sem_number(sem_key)
+                if sem is None or not isinstance(days, dict):
+                    continue
+                self.timetable[(dept, sem)] = {str(day)[:3].lower(): subjects for day, subjects in days.items()}
+        for dept, dates in self._data(docs, 'attendance.json').items():
+            if not isinstance(dates, dict):
+                continue
+            self.depts.add(dept)
+            self.attendance[dept] = {str(day): {_sem_number(k): v for k, v in sems.items() if _sem_number(k) is not None}
+                                     for day, sems in dates.items() if isinstance(sems, dict)}
+        for dept, years in self._data(docs, 'results.json').items():
+            if not isinstance(years, dict):
+                continue
+            self.depts.add(dept)
+            self.results[dept] = {str(year): {_sem_number(k): v for k, v in sems.items() if _sem_number(k) is not None}
+                                  for year, sems in years.items() if isinstance(sems, dict)}
+
+    def _load_fees(self, docs):
+        for cat, val in self._data(docs, 'fee_structure.json').items():
+            label = _humanize(cat)
+            if cat == 'notes':
+                continue
+            if isinstance(val, dict):
+                for item, amount in val.items():
+                    self.fees.append((label, item, amount, set(tokenize(cat + ' ' + item))))
+                    if cat == 'management_quota':
+                        code = _acronym(item).upper()
+                        self.dept_fee[code] = (item, amount)
+                        self.aliases.setdefault(item.lower(), code)
+                        self.aliases.setdefault(item.split()[0].lower(), code)
+                        self.aliases.setdefault(code.lower(), code)
+                        if ' and ' in item.lower():
+                            self.aliases.setdefault(item.lower().split(' and ')[0], code)
+            else:
+                self.fees.append((label, None, val, set(tokenize(cat))))
+        for code, names in (('CSE', ('cs', 'computer science')), ('ECE', ('ec', 'electronics')),
+                            ('ME', ('mech', 'mechanical'))):
+            for n in names:
+                self.aliases.setdefault(n, code)
+
+    def _dept(self, text, known, implied):
+        """Department named in the question (preferring one the table covers); if none is
+        named, `implied` is set and the table covers a single department, that one."""
+        named = None
+        if self.alias_re is not None:
+            for m in self.alias_re.finditer(text):
+                code = self.aliases[m.group(1)]
+                if code in known:
+                    return code
+                named = named or code
+        if named:
+            return named
+        return next(iter(known)) if implied and len(known) == 1 else None
+
+    def answer(self, text):
+        """Templated answer from the tables, or None to let later stages try."""
+        for intent, strong, weak in STRUCTURED_INTENTS:
+            named = any(re.search(r'\b' + re.escape(w), text) for w in strong)
+            if named or any(re.search(r'\b' + re.escape(w), text) for w in weak):
+                ans = getattr(self, '_' + intent)(text, named)
+                if ans:
+                    return ans
+        return None
+
+    def _timetable(self, text, implied):
+        known = {d for d, _ in self.timetable}
+        dept = self._dept(text, known, implied)
+        if dept is None:
+            return None
+        if dept not in known:
+            return f"No {dept} timetable is available yet (timetables: {', '.join(sorted(known))})."
+        sems = sorted(s for d, s in self.timetable if d == dept)
+        m = SEMESTER_RE.search(text)
+        sem = int(m.group(1) or m.group(2)) if m else (sems[0] if len(sems) == 1 else None)
+        if sem is None:
+            return f"{dept} timetables are available for semester {', '.join(map(str, sems))}. Which semester?"
+        days = self.timetable.get((dept, sem))
+        if days is None:
+            return f"No {dept} timetable for semester {sem} (available: {', '.join(map(str, sems))})."
+        day = next((DAY_ALIASES[t] for t in re.findall(r'[a-z]+', text) if t in DAY_ALIASES), None)
+        if day is None:
+            rows = '; '.join(f"{DAY_NAMES.get(d, d)}: {', '.join(map(str, s))}" for d, s in days.items())
+            return f"{dept} semester {sem} timetable — {rows}."
+        if day not in days:
+            listed = ', '.join(DAY_NAMES.get(d, d) for d in days)
+            return f"No {dept} semester {sem} classes are listed for {DAY_NAMES[day]} (timetable covers {listed})."
+        return f"{dept} semester {sem}, {DAY_NAMES[day]}: {', '.join(map(str, days[day]))}."
+
+    def _attendance(self, text, implied):
+        dept = self._dept(text, set(self.attendance), implied)
+        if dept is None:
+            return None
+        if not self.attendance.get(dept):
+            return f"No {dept} attendance is recorded yet (recorded: {', '.join(sorted(self.attendance))})."
+        dates = self.attendance[dept]
+        m = ISO_DATE_RE.search(text)
+        if m:
+            day = f'{int(m.group(1)):04d}-{int(m.group(2)):02d}-{int(m.group(3)):02d}'
+        else:
+            m = DMY_DATE_RE.search(text)
+            day = f'{int(m.group(3)):04d}-{int(m.group(2)):02d}-{int(m.group(1)):02d}' if m else None
+        label = day
+        if day is None:
+            day = max(dates)
+            label = f'{day} (latest recorded)'
+        if day not in dates:
+            return f"No {dept} attendance is recorded for {day} (recorded dates: {', '.join(sorted(dates))})."
+        by_sem = dates[day]
+        m = SEMESTER_RE.search(text)
+        if m:
+            sem = int(m.group(1) or m.group(2))
+            if sem not in by_sem:
+                return f"No {dept} {_ordinal(sem)} semester attendance is recorded for {day}."
+            return f"{dept} {_ordinal(sem)} semester attendance on {label}: {_percent(by_sem[sem])}."
+        rows = ', '.join(f'{_ordinal(s)} sem {_percent(v)}' for s, v in sorted(by_sem.items()))
+        return f"{dept} attendance on {label}: {rows}."
+
+    def _results(self, text, implied):
+        dept = self._dept(text, set(self.results), implied)
+        if dept is None:
+            return None
+        if not self.results.get(dept):
+            return f"No {dept} results are available yet (results: {', '.join(sorted(self.results))})."
+        years = self.results[dept]
+        m = YEAR_RE.search(text)
+        year = m.group(1) if m else max(years)
+        if year not in years:
+            return f"No {dept} results are available for {year} (available: {', '.join(sorted(years))})."
+        by_sem = years[year]
+        m = SEMESTER_RE.search(text)
+        sems = sorted(by_sem)
+        if m:
+            sem = int(m.group(1) or m.group(2))
+            if sem not in by_sem:
+                return f"No {dept} {_ordinal(sem)} semester results are available for {year}."
+            sems = [sem]
+        rows = []
+        for s in sems:
+            vals = by_sem[s]
+            if isinstance(vals, dict):
+                fields = ', '.join(f"{'average' if k == 'avg' else _humanize(k).lower()} {v}" for k, v in vals.items())
+            else:
+                fields = str(vals)
+            rows.append(f'{_ordinal(s)} sem: {fields}')
+        return f"{dept} {year} results — {'; '.join(rows)}."
+
+    def _fees(self, text, implied):
+        toks = set(tokenize(text)) - FEE_WORDS - STOPWORDS
+        if self.alias_re is not None and self.dept_fee:
+            m = self.alias_re.search(text)
+            code = self.aliases[m.group(1)] if m else None
+            if code in self.dept_fee and not toks & {'hostel', 'merit', 'transportation', 'admission', 'alumni'}:
+                name, amount = self.dept_fee[code]
+                return f"Management quota fee for {name}: {amount}."
+        best, best_score = [], 0
+        for entry in self.fees:
+            score = len(toks & entry[3])
+            if score > best_score:
+                best, best_score = [entry], score
+            elif score and score == best_score:
+                best.append(entry)
+        if len(best) == 1:
+            cat, item, amount, _ = best[0]
+            return f"{cat} — {item}: {amount}." if item else f"{cat}: {amount}."
+        # several items of one category (e.g. "hostel fees"): list them; mixed categories are
+        # left to the ranked search
+        if best and len({e[0] for e in best}) == 1:
+            return f"{best[0][0]}: " + '; '.join(f'{item}: {amount}' for _, item, amount, _ in best) + '.'
+        return None
+
+_STRUCTURED = None
+_STRUCTURED_LOCK = threading.Lock()
+
+def get_structured_data():
+    global _STRUCTURED
+    CORPUS.refresh()
+    sd = _STRUCTURED
+    if sd is None or sd.version != CORPUS.version:
+        with _STRUCTURED_LOCK:
+            sd = _STRUCTURED
+            version = CORPUS.version
+            if sd is None or sd.version != version:
+                sd = StructuredData(CORPUS.docs, version)
+                _STRUCTURED = sd
+    return sd
+
+def structured_answer(msg_lower):
+    return get_structured_data().answer(msg_lower)
+
+# Typo tolerance: a SymSpell-style deletion index over the FAQ trigger words and the college
+# data vocabulary. Every vocabulary word is stored under all its variants with up to N
+# characters deleted (N = 1 for words of 6-8 letters, 2 for longer ones); a misspelt token
+# is looked up by its own deletions and the few candidates are verified with a bounded
+# edit distance, so a lookup costs about the same however large the vocabulary grows.
+# Shorter words are never corrected: one edit away from a 5-letter data word is mostly an
+# ordinary English word ("hours" -> "tours", "proof" -> "prof"). When the normal stages find
+# nothing, unknown tokens are corrected and, if the correction's confidence reaches
+# FUZZY_MIN_CONFIDENCE, only strong local hits are accepted for the corrected text.
+FUZZY_MIN_CONFIDENCE = float(os.getenv('FUZZY_MIN_CONFIDENCE', '0.8'))
+FUZZY_MIN_LEN = 6
+# FAQ trigger words win ties against words that only occur in the college data
+FUZZY_TRIGGER_WEIGHT = 50
+
+def _max_edits(n):
+    if n < FUZZY_MIN_LEN:
+        return 0
+    return 1 if n < 9 else 2
+
+def _deletes(word, depth):
+    out = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+def _edit_distance(a, b, limit):
+    """Optimal string alignment distance between a and b, or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+def _is_subsequence(short, long):
+    it = iter(long)
+    return all(c in it for c in short)
+
+class FuzzyVocab:
+    def __init__(self, counts, version=0):
+        self.version = version
+        self.counts = counts          # word -> weight
+        self.index = {}               # deletion variant -> [words]
+        for w in counts:
+            for d in _deletes(w, _max_edits(len(w))):
+                self.index.setdefault(d, []).append(w)
+
+    def correct(self, token):
+        """(word, distance) for the closest known word within the edit bound, else None."""
+        if token in self.counts:
+            return token, 0
+        limit = _max_edits(len(token))
+        if not limit:
+            return None
+        best = None
+        seen = set()
+        for d in _deletes(token, limit):
+            for cand in self.index.get(d, ()):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                dist = _edit_distance(token, cand, limit)
+                if dist > limit:
+                    continue
+                # ties: dropped letters are the commonest typo ("facilty" is facility, not
+                # faculty), then the heavier word
+                rank = (dist, not _is_subsequence(token, cand), -self.counts[cand])
+                if best is None or rank < best[2]:
+                    best = (cand, dist, rank)
+        return best[:2] if best else None
+
+    def correct_message(self, msg_lower):
+        """(corrected message, confidence) if any token was corrected, else None. Confidence
+        is the lowest 1 - distance/length over the corrected tokens."""
+        confidence = 1.0
+        changes = {}
+        for tok in set(re.findall(r'[a-z]+', msg_lower)):
+            if len(tok) < FUZZY_MIN_LEN or tok in STOPWORDS or tok in self.counts:
+                continue
+            hit = self.correct(tok)
+            if hit is None:
+                continue
+            word, dist = hit
+            changes[tok] = word
+            confidence = min(confidence, 1.0 - dist / len(tok))
+        if not changes:
+            return None
+        corrected = re.sub(r'[a-z]+', lambda m: changes.get(m.group(), m.group()), msg_lower)
+        return corrected, confidence
+
+_FUZZY = None
+_FUZZY_LOCK = threading.Lock()
+
+def get_fuzzy_vocab():
+    global _FUZZY
+    CORPUS.refresh()
+    fv = _FUZZY
+    if fv is None or fv.version != CORPUS.version:
+        with _FUZZY_LOCK:
+            fv = _FUZZY
+            version = CORPUS.version
+            if fv is None or fv.version != version:
+                counts = {}
+                for doc in CORPUS.docs.values():
+                    for w in re.findall(r'[a-z]+', doc['lower']):
+                        counts[w] = counts.get(w, 0) + 1
+                for entry in FAQ.entries:
+                    for tr in entry.get('triggers', []):
+                        for w in re.findall(r'[a-z]+', (tr or '').lower()):
+                            counts[w] = counts.get(w, 0) + FUZZY_TRIGGER_WEIGHT
+                # words the policy stage relies on must never be "corrected" into college terms
+                for w in list(STOPWORDS) + OUTSIDE_KEYWORDS:
+                    counts.setdefault(w, 1)
+                fv = FuzzyVocab({w: c for w, c in counts.items() if len(w) >= FUZZY_MIN_LEN - 1}, version)
+                _FUZZY = fv
+    return fv
+
+# Read-mostly files (index.html, uploaded /static assets, the JSON behind /api/college_info
+# and /api/class_strengths) are served from an in-memory cache keyed on (mtime, size): the
+# rendered body, its gzip and brotli encodings and a content-hash ETag are built once per
+# file version. Clients revalidate with If-None-Match / If-Modified-Since and get a 304.
+ASSET_CACHE_MAX_BYTES = int(os.getenv('ASSET_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+ASSET_MIN_COMPRESS = 512
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+class StaticAsset:
+    def __init__(self, key, mimetype, body, mtime, compress=True, etag=None):
+        self.key = key
+        self.mimetype = mimetype
+        self.body = body
+        self.mtime = mtime
+        self.etag = etag or hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.encoded = {}
+        if compress and len(body) >= ASSET_MIN_COMPRESS and mimetype.startswith(COMPRESSIBLE_TYPES):
+            self.encoded['gzip'] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(body, quality=11)
+
+class AssetCache:
+    def __init__(self):
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def response(self, path, mimetype, render=None):
+        """Response for `path` (see get), or None if the file is missing. Files above
+        ASSET_CACHE_MAX_BYTES aren't cached: plain files are streamed by send_file with an
+        mtime/size ETag, rendered ones are rendered per request, uncompressed, with the
+        same kind of ETag."""
+        asset = self.get(path, mimetype, render)
+        if asset is not None:
+            return serve_asset(asset)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if render is None:
+            resp = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        with open(path, 'rb') as f:
+            body = render(f.read())
+        return serve_asset(StaticAsset(None, mimetype, body, st.st_mtime, compress=False,
+                                       etag=f'{st.st_mtime_ns:x}.{st.st_size:x}'))
+
+    def get(self, path, mimetype, render=None):
+        """Cached asset for the current version of `path`, None if missing or too large.
+        `render(raw_bytes) -> bytes` turns the file into the response body (default: as is)."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size > ASSET_CACHE_MAX_BYTES:
+            self._assets.pop(path, None)
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        asset = self._assets.get(path)
+        if asset is not None and asset.key == key:
+            return asset
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is None or asset.key != key:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                body = render(raw) if render else raw
+                asset = StaticAsset(key, mimetype, body, st.st_mtime)
+                self._assets[path] = asset
+        return asset
+
+ASSETS = AssetCache()
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        # encodings share the base tag: "abc", "abc-gzip" and "abc-br" all match
+        if tag.strip('"').split('-')[0] == etag:
+            return True
+    return False
+
+def serve_asset(asset):
+    """Response for a cached asset honouring conditional requests and Accept-Encoding."""
+    last_modified = datetime.utcfromtimestamp(int(asset.mtime))
+    inm = request.headers.get('If-None-Match')
+    not_modified = _etag_matches(inm, asset.etag)
+    if not inm and request.if_modified_since is not None:
+        not_modified = request.if_modified_since.replace(tzinfo=None) >= last_modified
+    encoding = None
+    for enc in ('br', 'gzip'):
+        if enc in asset.encoded and request.accept_encodings[enc]:
+            encoding = enc
+            break
+    if not_modified:
+        resp = Response(status=304)
+    else:
+        resp = Response(asset.encoded[encoding] if encoding else asset.body, mimetype=asset.mimetype)
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+    resp.headers['ETag'] = '"%s%s"' % (asset.etag, '-' + encoding if encoding else '')
+    resp.last_modified = last_modified
+    resp.headers['Cache-Control'] = 'no-cache'
+    if asset.encoded:
+        resp.vary.add('Accept-Encoding')
+    return resp
+
 # Serve index.html
 @app.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    resp = ASSETS.response('index.html', 'text/html; charset=utf-8')
+    if resp is None:
+        return send_from_directory('.', 'index.html')
+    return resp
 
-# API: Query - receives {message, role}
-@app.route('/api/query', methods=['POST'])
-def api_query():
-    data = request.get_json() or {}
-    message = data.get('message', '')
-    role = data.get('role', 'Guest')
-    # Normalize message and treat MMEC specially
-    msg_norm = (message or '').strip()
-    msg_lower = msg_norm.lower()
-    # treat MMEC as full college name for context
+@app.route('/static/<path:filename>')
+def static_upload(filename):
+    """Uploaded logo/background images (see /upload), with ETag revalidation."""
+    path = safe_join('static', filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"ok": False, "error": "not found"}), 404
+    resp = ASSETS.response(path, mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if resp is None:
+        return send_from_directory('static', filename)
+    return resp
+
+# Query pipeline stages, shared by /api/query and its streaming variant
+AI_ANSWER_LIMIT = 400
+AI_PREFIX = "Note: This answer is not from official MMEC data — "
+# FAQ matches covering less of the question than this let a structured answer go first
+FAQ_STRONG_COVERAGE = float(os.getenv('FAQ_STRONG_COVERAGE', '0.6'))
+PARTIAL_PREFIX = "The AI service is unavailable. Closest match in MMEC data (may not answer your question): "
+OUTSIDE_KEYWORDS = ['weather', 'movie', 'news', 'stock', 'football', 'cricket', 'recipe']
+
+def normalize_message(message):
+    # Normalize message and treat MMEC as full college name for context
+    msg_lower = (message or '').strip().lower()
     if 'mmec' in msg_lower:
         msg_lower = msg_lower.replace('mmec', 'maratha mandal engineering college')
+    return msg_lower
 
-    # Simple server-side offline FAQ (mirrors frontend). Developers: update here as needed.
-    offline_faq = [
-        {"triggers": ["about","about the college","college","mmec","history","established","location","address","contact","website"],
-         "answer": "Maratha Mandal Engineering College (MMEC) is located at R.S. No. 104, Halbhavi Village, New Vantmuri Post, Via-Kakati, Belagavi – 591113, Karnataka, India. Established in 1997, it is approved by AICTE and affiliated to VTU, Belagavi. Managed by Maratha Mandal (founded 1931). Website: https://www.mmec.edu.in. Contact: +91 9353364643, info@mmec.edu.in."},
-        {"triggers": ["branches","courses","streams","departments","what branches","courses offered","programs"],
-         "answer": "MMEC offers these major streams: Computer Science & Engineering (CSE); Robotics & Artificial Intelligence (R&AI); Mechanical Engineering; Electronics & Communication Engineering (ECE). All programs are affiliated to VTU and focus on practical skills and innovation."},
-        {"triggers": ["fees","fee","tuition","payment","payment details","fee structure"],
-         "answer": "Management Quota:\n- Computer Science and Engineering: ₹2,00,000/- per year\n- Electronics & Communication Engineering: ₹1,75,000/- per year\n- Robotics & Artificial Intelligence: ₹1,70,000/- per year\n- Mechanical Engineering: ₹35,000/- for 1st year, ₹55,000/- per year from 2nd year onwards\n\nMerit Students: ₹1,00,000/- per year\n\nOther Fees:\n- Admission form Fees: ₹1,200/-\n- Alumni Association Fees: ₹500/- (One time)\n- Dept. Association Fees: ₹500/- (Every year)\n- Transportation Fees: ₹12,000/- (Every year, ₹6,000 paid by Management, ₹6,000 by Student)\n\nHostel Fees:\n- Accommodation: ₹40,000/- per year\n- Deposit: ₹10,000/- (Non Refundable)\n- Food: ₹3,500/- to ₹3,800/- per month (subject to market rates)\n\nNotes: Admissions on merit via MMEC entrance test or KEA. No donations. Payments via online banking, UPI, cash, or DD. Bank cheques not accepted. Contact +91 9353364643 for details."},
-        {"triggers": ["admissions","how to apply","admission process","apply","eligibility"],
-         "answer": "Admissions to MMEC are based on relevant state and national entrance processes (KCET/COMEDK/JEE etc.) and VTU guidelines. Check https://www.mmec.edu.in/admissions or contact admissions at +91 9353364643 for current procedures and dates."},
-        {"triggers": ["placements","placement","jobs","placement support","career"],
-         "answer": "MMEC provides placement support through a dedicated placement cell that organizes training, internships and campus recruitment. Top recruiters include Infosys, TCS, Accenture and Bosch. Visit https://www.mmec.edu.in/placements for more details."},
-        {"triggers": ["contact","contact info","phone","email","website"],
-         "answer": "Contact: +91 9353364643 | info@mmec.edu.in. Website: https://www.mmec.edu.in"},
-        {"triggers": ["hod cse", "head of department cse", "faculty head cse", "hod computer science", "head computer science"],
-         "answer": "The Head of Department for Computer Science and Engineering (CSE) at MMEC is Swati Patil."},
-        {"triggers": ["hod ece", "head of department ece", "faculty head ece", "hod electronics", "head electronics"],
-         "answer": "The Head of Department for Electronics and Communication Engineering (ECE) at MMEC is Prof. Vaibhav Kakade."},
-        {"triggers": ["hod mechanical", "head of department mechanical", "faculty head mechanical", "hod mech", "head mech"],
-         "answer": "The Head of Department for Mechanical Engineering at MMEC is Anand Mattikal."},
-        {"triggers": ["director","principal","vice principal","leadership"],
-         "answer": "Director: Dr. Deepak G. Kulkarni (PhD Management Sciences, M.E. Mech). Principal: Dr. Praveen Chitti (PhD Image Processing, M.Tech VLSI, B.E. ECE). Vice-Principal: Dr. Suresh Mashyal (Hybrid Wind-Diesel Energy Systems)."},
-        {"triggers": ["at a glance","mmec at a glance","overview"],
-         "answer": "MMEC, established 1997, provides technical education in North Karnataka. Affiliated to VTU, approved by AICTE. Focus on science, technology, innovation. Managed by Maratha Mandal (1931). Mission: Advance knowledge for nation/world challenges."},
-        {"triggers": ["department","departments"],
-         "answer": "Departments: CSE, ECE, Mechanical, Robotics & AI."},
-        {"triggers": ["placement cell","placement"],
-         "answer": "Dedicated placement cell for training, internships, campus recruitment. Top recruiters: Infosys, TCS, Accenture, Bosch. Visit https://www.mmec.edu.in/placements."},
-        {"triggers": ["nirf","ranking"],
-         "answer": "NIRF ranking: Check https://www.mmec.edu.in for latest."},
-        {"triggers": ["library"],
-         "answer": "Library facilities available; contact college for details."},
-        {"triggers": ["gallery"],
-         "answer": "Photo gallery on website: https://www.mmec.edu.in/gallery."},
-        {"triggers": ["e news letter","newsletter"],
-         "answer": "E-newsletter available; subscribe via website."},
-        {"triggers": ["facilities","facilities & others"],
-         "answer": "Various facilities including labs, sports, etc.; visit https://www.mmec.edu.in/facilities."},
-        {"triggers": ["multilingual books","books"],
-         "answer": "Multilingual books available in library."},
-        {"triggers": ["alumni cell","alumni"],
-         "answer": "Alumni cell for networking and events."},
-        {"triggers": ["nsdc"],
-         "answer": "NSDC training programs available."},
-        {"triggers": ["contact us"],
-         "answer": "Contact: +91 9353364643 | info@mmec.edu.in. Website: https://www.mmec.edu.in"},
-        {"triggers": ["faculty","staff","teachers","professors"],
-         "answer": "Faculty information is not updated yet. Please check back later."}
-    ]
-    # Simplified offline matching: check if any trigger appears in normalized message
-    for entry in offline_faq:
-        for tr in entry['triggers']:
-            if tr in msg_lower or msg_lower in tr:
-                # return short authoritative offline answer
-                return jsonify({"answer": entry['answer'], "source": "offline"})
-
-    # Next: search data/college_info files for a direct answer (exact keywords or small fuzzy search)
-    def search_college_files(query_lower):
-        base = os.path.join('data', 'college_info')
-        if not os.path.exists(base):
-            return None
-        # check info.md for phrase matches
-        info_path = os.path.join(base, 'info.md')
-        try:
-            if os.path.exists(info_path):
-                with open(info_path, 'r', encoding='utf-8') as f:
-                    txt = f.read().lower()
-                if query_lower in txt:
-                    # return a short extract: first 400 chars around first occurrence
-                    idx = txt.find(query_lower)
-                    start = max(0, idx - 120)
-                    snippet = txt[start:start+400].strip()
-                    return snippet
-        except Exception:
-            pass
-        # check json files for keys or values
-        for fn in os.listdir(base):
-            if fn.endswith('.json'):
-                try:
-                    with open(os.path.join(base, fn), 'r', encoding='utf-8') as f:
-                        j = json.load(f)
-                    sj = json.dumps(j).lower()
-                    if query_lower in sj:
-                        # return tiny summary
-                        return f"Found relevant data in {fn}. Use the college info panel for details."
-                except Exception:
-                    continue
-        return None
+def local_answer(msg_lower, fuzzy=True):
+    """Offline FAQ, then structured tables, then college data search, then the outside-scope
+    policy, then the same again with typos corrected. None means 'ask AI'."""
+    # Server-side offline FAQ (mirrors frontend). Entries live in data/faq.json and are
+    # compiled once at startup; every matching entry comes back scored, best first.
+    with METRICS.timed('mmec_stage_seconds', stage='faq'):
+        matches = FAQ.match(msg_lower)
+    if matches and matches[0][1] >= FAQ_STRONG_COVERAGE:
+        # return short authoritative offline answer
+        return {"answer": matches[0][0]['answer'], "source": "offline"}
+
+    # Timetable / attendance / results / fee questions answered from the parsed tables. A
+    # trigger covering only a small part of the question ("fee" in "management fee for
+    # cse") is too generic to beat a specific table answer, but still wins over search.
+    with METRICS.timed('mmec_stage_seconds', stage='structured'):
+        structured = structured_answer(msg_lower)
+    if structured:
+        return {"answer": structured, "source": "college_data"}
+    if matches:
+        return {"answer": matches[0][0]['answer'], "source": "offline"}
 
-    college_answer = search_college_files(msg_lower)
+    # Next: search data/college_info files for a direct answer (served from the in-memory corpus)
+    with METRICS.timed('mmec_stage_seconds', stage='college_data'):
+        college_answer = search_college_files(msg_lower)
     if college_answer:
-        return jsonify({"answer": college_answer, "source": "college_data"})
+        return {"answer": college_answer, "source": "college_data"}
 
     # If we reach here the query is outside our local knowledge. Use AI fallback but keep it college-focused.
     # The policy: the bot is college-only. If the user asks about unrelated topics, respond with a short refusal.
     # Lightweight heuristic: if the query contains words like 'weather','movie','news' treat as outside scope.
-    outside_keywords = ['weather', 'movie', 'news', 'stock', 'football', 'cricket', 'recipe']
-    if any(k in msg_lower for k in outside_keywords):
-        return jsonify({"answer": "This chatbot provides information about Maratha Mandal Engineering College (MMEC) only. For other queries please use a general search.", "source": "policy"})
-
-    # Otherwise call AI fallback (OpenAI preferred)
-    ai_answer = call_gemini(message, role)
-    # Prefix with disclaimer when AI is used (not official college data)
-    prefix = "Note: This answer is not from official MMEC data — "
+    with METRICS.timed('mmec_stage_seconds', stage='policy'):
+        outside = any(k in msg_lower for k in OUTSIDE_KEYWORDS)
+    if outside:
+        return {"answer": "This chatbot provides information about Maratha Mandal Engineering College (MMEC) only. For other queries please use a general search.", "source": "policy"}
+
+    if fuzzy:
+        with METRICS.timed('mmec_stage_seconds', stage='fuzzy'):
+            fixed = get_fuzzy_vocab().correct_message(msg_lower)
+            if fixed and fixed[1] >= FUZZY_MIN_CONFIDENCE:
+                return strong_local_answer(fixed[0])
+    return None
+
+def strong_local_answer(msg_lower):
+    """Only the confident local answers for a typo-corrected message: an FAQ hit, a
+    structured answer or a college-data doc covering every query term. Anything weaker goes
+    to AI rather than answering a guessed word as official data."""
+    matches = FAQ.match(msg_lower)
+    if matches and matches[0][1] >= FAQ_STRONG_COVERAGE:
+        return {"answer": matches[0][0]['answer'], "source": "offline"}
+    structured = structured_answer(msg_lower)
+    if structured:
+        return {"answer": structured, "source": "college_data"}
+    if matches:
+        return {"answer": matches[0][0]['answer'], "source": "offline"}
+    college_answer = search_college_files(msg_lower, min_coverage=1.0)
+    if college_answer:
+        return {"answer": college_answer, "source": "college_data"}
+    return None
+
+def shape_ai_answer(ai_answer, msg_lower):
+    """Turn call_gemini output (answer or marker string) into the {answer, source} reply."""
     # If the ai_answer already contains our '[AI not configured]' style message, return short fallback instead
     if isinstance(ai_answer, str) and ai_answer.startswith('[AI not configured]'):
         # keep it short and actionable
-        return jsonify({"answer": "Sorry, AI service is not configured on the server. The chatbot answers college FAQs from local data.", "source": "error"})
-    if isinstance(ai_answer, str) and ai_answer.startswith('[AI error]'):
-        return jsonify({"answer": "Error contacting AI provider. Try again later or ask a college-specific question.", "source": "error"})
-    # Ensure short answer: limit to 400 chars
+        return {"answer": "Sorry, AI service is not configured on the server. The chatbot answers college FAQs from local data.", "source": "error"}
+    if isinstance(ai_answer, str) and ai_answer.startswith(('[AI error]', '[AI unavailable]')):
+        # providers failing or timed out: fail fast to the best partial match in local data.
+        # The normal stages already found nothing at full coverage, so this is a guess and
+        # says so rather than passing as official data.
+        fallback = search_college_files(msg_lower, min_coverage=0.34, strict_terms=0)
+        if fallback:
+            return {"answer": PARTIAL_PREFIX + fallback, "source": "partial"}
+        return {"answer": "Error contacting AI provider. Try again later or ask a college-specific question.", "source": "error"}
+    # Ensure short answer: limit to 400 chars; prefix with disclaimer (not official college data)
     if isinstance(ai_answer, str):
         short = ai_answer.strip()
-        if len(short) > 400:
-            short = short[:390].rsplit('.',1)[0] + '.'
-        return jsonify({"answer": prefix + short, "source": "ai"})
-    return jsonify({"answer": "Sorry, couldn't generate an answer.", "source": "error"})
+        if len(short) > AI_ANSWER_LIMIT:
+            short = short[:AI_ANSWER_LIMIT - 10].rsplit('.',1)[0] + '.'
+        return {"answer": AI_PREFIX + short, "source": "ai"}
+    return {"answer": "Sorry, couldn't generate an answer.", "source": "error"}
+
+def wants_event_stream():
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+# API: Query - receives {message, role}
+@app.route('/api/query', methods=['POST'])
+def api_query():
+    if wants_event_stream():
+        return api_query_stream()
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    role = data.get('role', 'Guest')
+    msg_lower = normalize_message(message)
+    res = local_answer(msg_lower)
+    if res is None:
+        # Otherwise call AI fallback (OpenAI preferred); repeated questions come from the response cache
+        with METRICS.timed('mmec_stage_seconds', stage='ai'):
+            res = shape_ai_answer(cached_call_gemini(message, role, msg_lower), msg_lower)
+    METRICS.inc('mmec_answers_total', source=res['source'])
+    return jsonify(res)
+
+# Batch queries: {items: [{message, role}, ...]} (or a bare list). The local stages run once
+# per distinct normalized message; only the misses go to the AI stage, at most
+# AI_BATCH_CONCURRENCY at a time. With "use_ai": false misses come back as source "none"
+# (handy for replaying logs after FAQ/data edits). The AI stage gets AI_BATCH_BUDGET seconds
+# in total; misses not answered by then come back as source "skipped" so the caller can
+# resend them. Results keep the request order.
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '5000'))
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', '4'))
+AI_BATCH_BUDGET = float(os.getenv('AI_BATCH_BUDGET', '30'))
+
+@app.route('/api/query/batch', methods=['POST'])
+def api_query_batch():
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = {"items": data}
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        return jsonify({"ok": False, "error": "expected {items: [{message, role}, ...]}"}), 400
+    items = data['items']
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"ok": False, "error": f"too many items (max {BATCH_MAX_ITEMS})"}), 413
+    use_ai = data.get('use_ai', True) is not False
+    default_role = data.get('role', 'Guest')
+    if not isinstance(default_role, str):
+        default_role = 'Guest'
+
+    queries = []
+    for it in items:
+        if isinstance(it, str):
+            it = {"message": it}
+        elif not isinstance(it, dict):
+            it = {}
+        # malformed fields are treated like a malformed item, not allowed to fail the batch
+        message = it.get('message')
+        message = message if isinstance(message, str) else ''
+        role = it.get('role')
+        role = role if isinstance(role, str) else default_role
+        queries.append((message, role, normalize_message(message)))
+
+    # local stages, once per distinct normalized message
+    local = {}
+    for _, _, msg_lower in queries:
+        if msg_lower not in local:
+            local[msg_lower] = local_answer(msg_lower)
+
+    # AI stage for the misses, once per distinct (normalized message, role)
+    ai_keys = {}
+    for message, role, msg_lower in queries:
+        if local[msg_lower] is None and use_ai:
+            ai_keys.setdefault((msg_lower, role), message)
+    ai = {}
+    if ai_keys:
+        pool = ThreadPoolExecutor(max_workers=max(1, AI_BATCH_CONCURRENCY), thread_name_prefix='ai-batch')
+        try:
+            futures = {k: pool.submit(cached_call_gemini, message, k[1], k[0]) for k, message in ai_keys.items()}
+            wait(futures.values(), timeout=AI_BATCH_BUDGET)
+            for k, fut in futures.items():
+                if fut.done():
+                    ai[k] = shape_ai_answer(fut.result(), k[0])
+                else:
+                    ai[k] = {"answer": None, "source": "skipped"}
+        finally:
+            # unstarted calls are dropped; running ones end within AI_DEADLINE and still fill the cache
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for message, role, msg_lower in queries:
+        res = local[msg_lower] or ai.get((msg_lower, role)) or {"answer": None, "source": "none"}
+        METRICS.inc('mmec_answers_total', source=res['source'])
+        results.append(dict(res, message=message))
+    return jsonify({"ok": True, "count": len(results), "results": results})
+
+def sse(event, data):
+    if event in ('answer', 'done'):
+        METRICS.inc('mmec_answers_total', source=data.get('source', 'error'))
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _run_in_thread(fn, *args):
+    """Run fn on a daemon thread and return a Future for its result (used where waiting on
+    the shared AI pool from inside it could deadlock)."""
+    fut = Future()
+
+    def run():
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return fut
+
+def _pump_stream(call, message, role, out, stop):
+    """Read provider.stream() on its own thread into `out` as ('piece', text) items, then
+    ('end', None) or ('error', exc), until the stream ends or `stop` is set. The provider's
+    outcome is recorded here unless the consumer already abandoned the call."""
+    p = call.provider
+    pieces = None
+    error = None
+    try:
+        pieces = p.stream(message, role)
+        for piece in pieces:
+            if stop.is_set():
+                break
+            out.put(('piece', piece))
+    except Exception as e:
+        error = e
+    finally:
+        close = getattr(pieces, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+        if call.finish():
+            dt = time.monotonic() - call.started
+            if error is None:
+                p.breaker.success()
+                p.latencies.add(dt)
+                METRICS.observe('mmec_provider_seconds', dt, provider=p.name, outcome='ok')
+            else:
+                p.breaker.failure()
+                METRICS.observe('mmec_provider_seconds', dt, provider=p.name, outcome='error')
+        out.put(('error', error) if error is not None else ('end', None))
+
+def start_provider_stream(message, role, exclude=()):
+    """Start streaming from the first provider whose breaker admits a call; returns
+    (ProviderCall, queue, stop event) or None."""
+    for p in PROVIDERS.available():
+        if p in exclude or p.abandoned >= AI_MAX_ABANDONED or not p.breaker.allow():
+            continue
+        call = ProviderCall(p)
+        out = queue.Queue()
+        stop = threading.Event()
+        threading.Thread(target=_pump_stream, args=(call, message, role, out, stop), daemon=True).start()
+        return call, out, stop
+    return None
+
+def stream_query_events(message, role):
+    """Server-sent events for one query: a single 'answer' event for local/cached/error
+    replies, otherwise 'delta' events as provider tokens arrive and a final 'done' event
+    carrying the cleaned-up answer. Generation stops once AI_ANSWER_LIMIT is reached.
+    The provider stream runs on its own thread under the same AI_DEADLINE and hedging as
+    call_gemini: no first token by the hedge delay asks the other providers in parallel,
+    and a failed or silent stream falls back to them."""
+    msg_lower = normalize_message(message)
+    local = local_answer(msg_lower)
+    if local:
+        yield sse('answer', local)
+        return
+    # timed until the last event (or the client leaving), like the 'ai' stage of /api/query
+    with METRICS.timed('mmec_stage_seconds', stage='ai'):
+        key = ai_cache_key(message, role, msg_lower)
+        cached = AI_CACHE.get(key)
+        if cached is not None:
+            yield sse('answer', shape_ai_answer(cached, msg_lower))
+            return
+        flight, leader = SINGLE_FLIGHT.begin(key)
+        if not leader:
+            # the same question is already being asked: replay that stream instead of starting another
+            yield from _follow_stream(flight, msg_lower)
+            return
+        try:
+            yield from _lead_stream(message, role, msg_lower, key, flight)
+        finally:
+            # followers (streaming or not) get whatever the leader ended up with, even on disconnect
+            SINGLE_FLIGHT.finish(key, flight)
+
+def _follow_stream(flight, msg_lower):
+    """Replay an in-flight stream for a coalesced request: the leader's deltas so far,
+    then the rest as they arrive, then its final answer."""
+    sent = False
+    try:
+        for piece in SINGLE_FLIGHT.follow(flight, AI_DEADLINE + AI_SINGLEFLIGHT_SLACK):
+            yield sse('delta', {"text": AI_PREFIX + piece, "source": "ai"} if not sent else {"text": piece})
+            sent = True
+        ans = flight['result']
+    except Exception as e:
+        print('AI call error', e)
+        ans = "[AI error] Failed to get an answer. Check server logs."
+    yield sse('done' if sent or flight['streamed'] else 'answer', shape_ai_answer(ans, msg_lower))
+
+def _lead_stream(message, role, msg_lower, key, flight):
+    """Run the provider stream for stream_query_events, publishing each delta and the
+    final raw answer to `flight` for coalesced followers."""
+    deadline = time.monotonic() + AI_DEADLINE
+    started = start_provider_stream(message, role)
+    if started is None:
+        flight['result'] = ans = call_gemini(message, role)
+        yield sse('answer', shape_ai_answer(ans, msg_lower))
+        return
+    flight['streamed'] = True
+    call, out, stop = started
+    provider = call.provider
+    hedge_at = call.started + provider.hedge_delay()
+    hedge = None
+    collected = ''
+    finished = False   # the provider ended the stream (or we hit the length limit)
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if not collected and hedge is not None and hedge.done():
+                ans = hedge.result()
+                if not ans.startswith('[AI '):
+                    # the hedge answered before the stream's first token: it wins
+                    AI_CACHE.put(key, ans)
+                    flight['result'] = ans
+                    yield sse('done', shape_ai_answer(ans, msg_lower))
+                    return
+                hedge = False   # hedge failed; keep waiting for the stream
+            wait_for = deadline - now
+            if not collected:
+                if hedge is None and now >= hedge_at and len(PROVIDERS.available()) > 1:
+                    # slow first token: ask the rest of the chain in parallel
+                    hedge = _run_in_thread(call_gemini, message, role, deadline - now, (provider,))
+                if hedge is None:
+                    wait_for = min(wait_for, max(0.0, hedge_at - now))
+                elif hedge:
+                    wait_for = min(wait_for, 0.05)
+            try:
+                kind, value = out.get(timeout=wait_for)
+            except queue.Empty:
+                continue
+            if kind == 'error':
+                print(f'{provider.name} stream error:', value)
+                break
+            if kind == 'end':
+                finished = True
+                break
+            piece = (value or '')[:AI_ANSWER_LIMIT - len(collected)]
+            if not piece:
+                continue
+            if not collected:
+                # disclaimer goes out with the first token, so an early failure shows none
+                yield sse('delta', {"text": AI_PREFIX + piece, "source": "ai"})
+            else:
+                yield sse('delta', {"text": piece})
+            collected += piece
+            SINGLE_FLIGHT.publish(flight, piece)
+            if len(collected) >= AI_ANSWER_LIMIT:
+                # the rest would be cut anyway: stop generating
+                finished = True
+                break
+    finally:
+        # also runs on client disconnect (GeneratorExit): the pump thread notices, closes the
+        # provider stream and records its outcome, so a half-open trial is always released
+        stop.set()
+    if collected:
+        if finished and collected.strip():
+            AI_CACHE.put(key, collected)
+        flight['result'] = collected
+        yield sse('done', shape_ai_answer(collected, msg_lower))
+        return
+    # nothing streamed: stream failed or no token before the deadline
+    if time.monotonic() >= deadline and call.abandon(running=True):
+        print(f'{provider.name} stream timed out after deadline')
+        provider.breaker.failure()
+        METRICS.observe('mmec_provider_seconds', time.monotonic() - call.started, provider=provider.name, outcome='timeout')
+    if hedge:
+        ans = hedge.result(timeout=max(0.0, deadline - time.monotonic()) + 1.0) if not hedge.done() else hedge.result()
+    else:
+        remaining = deadline - time.monotonic()
+        if remaining > 0 and len(PROVIDERS.available()) > 1:
+            ans = call_gemini(message, role, remaining, (provider,))
+        else:
+            ans = f"[AI error] {provider.name} failed or did not answer in time."
+    if not ans.startswith('[AI '):
+        AI_CACHE.put(key, ans)
+    flight['result'] = ans
+    yield sse('done', shape_ai_answer(ans, msg_lower))
+
+@app.route('/api/query/stream', methods=['GET','POST'])
+def api_query_stream():
+    """Streaming /api/query: POST {message, role} (or GET ?message=&role= for EventSource)."""
+    if request.method == 'GET':
+        message = request.args.get('message', '')
+        role = request.args.get('role', 'Guest')
+    else:
+        data = request.get_json(silent=True) or {}
+        message = data.get('message', '')
+        role = data.get('role', 'Guest')
+    return Response(stream_with_context(timed_stream(stream_query_events(message, role))), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/logs', methods=['GET','POST','DELETE'])
 def api_logs():
-    # GET: return logs
+    # GET: ?limit=N&before=<cursor> returns one page (oldest-first) plus next_before;
+    # without limit the whole log is streamed as {"logs": [...]}
     if request.method == 'GET':
-        logs = load_logs()
-        return jsonify({"logs": logs})
+        limit = request.args.get('limit')
+        before = request.args.get('before')
+        if limit or before:
+            try:
+                limit = max(1, min(int(limit or 100), 1000))
+                before = int(before) if before else None
+            except ValueError:
+                return jsonify({"ok": False, "error": "bad cursor"}), 400
+            if before is not None and before < 0:
+                return jsonify({"ok": False, "error": "bad cursor"}), 400
+            with METRICS.timed('mmec_storage_seconds', op='logs_page', backend='jsonl'):
+                logs, next_before = LOGS.page(limit, before)
+            return jsonify({"logs": logs, "next_before": next_before})
+        def generate():
+            yield '{"logs": ['
+            sep = ''
+            for ln in LOGS.iter_raw():
+                yield sep + ln
+                sep = ','
+            yield ']}'
+        return Response(generate(), mimetype='application/json')
     # POST: append a log entry
     if request.method == 'POST':
         data = request.get_json() or {}
@@ -233,13 +1725,13 @@ def api_logs():
             "bot_msg": data.get('bot_msg', ''),
             "offline": bool(data.get('offline', False))
         }
-        logs = load_logs()
-        logs.append(entry)
-        save_logs(logs)
+        with METRICS.timed('mmec_storage_seconds', op='logs_append', backend='jsonl'):
+            LOGS.append(entry)
         return jsonify({"ok": True})
     # DELETE: clear logs
     if request.method == 'DELETE':
-        save_logs([])
+        with METRICS.timed('mmec_storage_seconds', op='logs_clear', backend='jsonl'):
+            LOGS.clear()
         return jsonify({"ok": True})
 
 
@@ -259,8 +1751,7 @@ def api_login():
         expected = users.get(username)
         if expected and expected == password:
             # create a short session token for admin (simple prototype)
-            token = str(uuid.uuid4())
-            SESSIONS[token] = username
+            token = SESSIONS.create(username)
             return jsonify({"ok": True, "role": username, "token": token})
         return jsonify({"ok": False, "error": "invalid credentials"}), 401
     except Exception as e:
@@ -298,96 +1789,689 @@ def upload_files():
         return jsonify({"ok": True, "files": saved})
     return jsonify({"ok": False, "error": "no files uploaded"}), 400
 
-def call_gemini(message, role):
-    """
-    TODO: Integrate the Gemini API here.
-    The intended model is: gemini-2.0-flash (generateContent).
-    This function must:
-      - Construct the prompt/context (include role or basic system prompt)
-      - Send the request to Gemini
-      - Return the text response.
-
-    Example notes (developer):
-    - Place your Gemini or Google Generative API key in environment variable GEMINI_API_KEY.
-    - Using Google Generative API may require client library or service account.
-    """
-    # Prefer GEMINI_API_KEY, but allow an OpenAI fallback using OPENAI_API_KEY.
-    gemini_key = os.getenv('GEMINI_API_KEY', '')
-    openai_key = os.getenv('OPENAI_API_KEY', '')
+# AI providers. Each provider imports its client library, configures it and builds its
+# client once (warm()), keeping the model object / pooled keep-alive HTTP session for
+# every later call. call_gemini() asks them in registry order. AI_PROVIDER=stub swaps in
+# a local stub (AI_STUB_LATENCY_MS, AI_STUB_ERROR_RATE) for tests and benchmarks.
+SYSTEM_PROMPT = ("You are an assistant for Maratha Mandal Engineering College (MMEC). Answer college-related queries "
+                 "concisely and helpfully. If the user asks unrelated topics, say you only provide MMEC information.")
+
+# Dispatch policy: every request gets an AI_DEADLINE (seconds) for the whole fallback chain.
+# Provider calls run on a shared pool, so a hung provider never holds a Flask worker past
+# the deadline. If the primary hasn't answered by its AI_HEDGE_PERCENTILE latency (or
+# AI_HEDGE_DELAY_MS until enough samples exist) the next provider is asked in parallel and
+# the first answer wins. Each provider has a circuit breaker that opens after
+# AI_BREAKER_THRESHOLD consecutive failures and lets one trial call through after
+# AI_BREAKER_COOLDOWN seconds. A call still running at the deadline is abandoned: it counts
+# as one failure and its late result is dropped. A provider with AI_MAX_ABANDONED abandoned
+# calls still occupying pool threads is skipped until they return.
+AI_DEADLINE = float(os.getenv('AI_DEADLINE', '12'))
+AI_HEDGE_PERCENTILE = float(os.getenv('AI_HEDGE_PERCENTILE', '95'))
+AI_HEDGE_DELAY_MS = float(os.getenv('AI_HEDGE_DELAY_MS', '2500'))
+AI_BREAKER_THRESHOLD = int(os.getenv('AI_BREAKER_THRESHOLD', '5'))
+AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+AI_POOL_SIZE = int(os.getenv('AI_POOL_SIZE', '16'))
+AI_MAX_ABANDONED = int(os.getenv('AI_MAX_ABANDONED', str(max(1, AI_POOL_SIZE // 4))))
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown and not self._trial:
+                self._trial = True  # one trial call while half-open
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+class LatencyWindow:
+    """Recent successful call latencies, for the hedging percentile."""
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p, default):
+        data = sorted(self.samples)
+        if len(data) < 20:
+            return default
+        return data[min(len(data) - 1, int(len(data) * p / 100.0))]
+
+class AIProvider:
+    name = 'base'
+    # OpenAI calls leave our infrastructure, so they honour allow_external_queries
+    needs_external = False
+
+    def __init__(self):
+        self.ready = False
+        self.error = None
+        self._warmed = False
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_COOLDOWN)
+        self.latencies = LatencyWindow()
+        self.abandoned = 0   # calls given up on at the deadline that still hold a pool thread
+
+    def hedge_delay(self):
+        return self.latencies.percentile(AI_HEDGE_PERCENTILE, AI_HEDGE_DELAY_MS / 1000.0)
+
+    def configured(self):
+        return False
+
+    def warm(self):
+        """Import/configure/build the client once. Returns readiness."""
+        if self._warmed:
+            return self.ready
+        with self._lock:
+            if not self._warmed:
+                if self.configured():
+                    try:
+                        self._setup()
+                        self.ready = True
+                    except Exception as e:
+                        self.error = str(e)
+                        print(f'{self.name} provider init error:', e)
+                self._warmed = True
+        return self.ready
+
+    def _setup(self):
+        pass
+
+    def usable(self):
+        return self.warm() and (not self.needs_external or is_external_allowed())
 
-    # Try Gemini (Google Generative) first if key present and library available
-    if gemini_key:
+    def generate(self, message, role):
+        raise NotImplementedError
+
+    def stream(self, message, role):
+        """Yield the answer in pieces as they arrive; closing the generator stops the call.
+        Providers without a streaming API yield the whole answer once."""
+        yield self.generate(message, role)
+
+def _clip(ans, limit):
+    ans = ans.strip()
+    if len(ans) > limit:
+        ans = ans[:limit - 10].rsplit('.', 1)[0] + '.'
+    return ans
+
+class GeminiProvider(AIProvider):
+    name = 'gemini'
+
+    def configured(self):
+        return bool(os.getenv('GEMINI_API_KEY', ''))
+
+    def _setup(self):
+        self.genai = importlib.import_module('google.generativeai')
+        key = os.getenv('GEMINI_API_KEY', '')
         try:
-            import importlib
-            genai = importlib.import_module('google.generativeai')
+            # some versions/clients expect configure(); others accept api_key
+            if hasattr(self.genai, 'configure'):
+                self.genai.configure(api_key=key)
+            else:
+                setattr(self.genai, 'api_key', key)
+        except Exception:
+            pass
+        self.model = self.genai.GenerativeModel('gemini-2.0-flash') if hasattr(self.genai, 'GenerativeModel') else None
+        if self.model is None and not hasattr(self.genai, 'generate_text'):
+            raise RuntimeError('google.generativeai has neither GenerativeModel nor generate_text')
+
+    def generate(self, message, role):
+        if self.model is not None:
             try:
-                # some versions/clients expect configure(); others accept api_key
-                if hasattr(genai, 'configure'):
-                    genai.configure(api_key=gemini_key)
-                else:
-                    setattr(genai, 'api_key', gemini_key)
+                prompt = f"{SYSTEM_PROMPT}\nUser: {message}"
+                try:
+                    resp = self.model.generate_content(prompt, request_options={'timeout': AI_DEADLINE})
+                except TypeError:
+                    # older google.generativeai releases have no request_options
+                    resp = self.model.generate_content(prompt)
+                ans = getattr(resp, 'text', None) or getattr(resp, 'content', None) or str(resp)
+                return _clip(ans, 800) if isinstance(ans, str) else ans
+            except Exception as e:
+                if not hasattr(self.genai, 'generate_text'):
+                    raise
+                print('Gemini model.generate_content error:', e)
+        # Fallback: some genai wrappers provide a generate_text helper
+        out = self.genai.generate_text(model='models/text-bison-001', input=f"MMEC assistant: {message}")
+        return getattr(out, 'text', None) or str(out)
+
+    def stream(self, message, role):
+        if self.model is None:
+            yield self.generate(message, role)
+            return
+        prompt = f"{SYSTEM_PROMPT}\nUser: {message}"
+        try:
+            resp = self.model.generate_content(prompt, stream=True, request_options={'timeout': AI_DEADLINE})
+        except TypeError:
+            resp = self.model.generate_content(prompt, stream=True)
+        for chunk in resp:
+            text = getattr(chunk, 'text', None)
+            if text:
+                yield text
+
+class OpenAIProvider(AIProvider):
+    name = 'openai'
+    needs_external = True
+
+    def configured(self):
+        return bool(os.getenv('OPENAI_API_KEY', ''))
+
+    def _setup(self):
+        openai = importlib.import_module('openai')
+        key = os.getenv('OPENAI_API_KEY', '')
+        self.client = None
+        self.legacy = None
+        if hasattr(openai, 'OpenAI'):
+            # openai>=1.0: one client = one pooled httpx connection pool (keep-alive)
+            kwargs = {'api_key': key, 'timeout': AI_DEADLINE, 'max_retries': 0}
+            try:
+                httpx = importlib.import_module('httpx')
+                kwargs['http_client'] = httpx.Client(limits=httpx.Limits(max_connections=50, max_keepalive_connections=20))
             except Exception:
                 pass
-            # Attempt using GenerativeModel if available
-            if hasattr(genai, 'GenerativeModel'):
-                try:
-                    model = genai.GenerativeModel('gemini-2.0-flash')
-                    prompt = (f"You are an assistant for Maratha Mandal Engineering College (MMEC). "
-                              f"Answer college-related queries concisely and helpfully. If the user asks unrelated topics, say you only provide MMEC information.\nUser: {message}")
-                    resp = model.generate_content(prompt)
-                    ans = getattr(resp, 'text', None) or getattr(resp, 'content', None) or str(resp)
-                    if isinstance(ans, str):
-                        ans = ans.strip()
-                        if len(ans) > 800:
-                            ans = ans[:790].rsplit('.',1)[0] + '.'
-                    return ans
-                except Exception as e:
-                    print('Gemini model.generate_content error:', e)
-            # Fallback: some genai wrappers provide a generate_text helper
+            self.client = openai.OpenAI(**kwargs)
+        else:
+            # openai<1.0 module-level API: set the key once and share a keep-alive session
+            openai.api_key = key
             try:
-                if hasattr(genai, 'generate_text'):
-                    out = genai.generate_text(model='models/text-bison-001', input=f"MMEC assistant: {message}")
-                    ans = getattr(out, 'text', None) or str(out)
-                    return ans
+                requests_mod = importlib.import_module('requests')
+                session = requests_mod.Session()
+                session.mount('https://', requests_mod.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=50))
+                openai.requestssession = session
+            except Exception:
+                pass
+            self.legacy = openai
+
+    def generate(self, message, role):
+        messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': message}]
+        if self.client is not None:
+            resp = self.client.chat.completions.create(model='gpt-3.5-turbo', messages=messages, max_tokens=300, temperature=0.2)
+        else:
+            resp = self.legacy.ChatCompletion.create(model='gpt-3.5-turbo', messages=messages, max_tokens=300, temperature=0.2,
+                                                     request_timeout=AI_DEADLINE)
+        return _clip(resp.choices[0].message.content, 600)
+
+    def stream(self, message, role):
+        messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': message}]
+        if self.client is not None:
+            resp = self.client.chat.completions.create(model='gpt-3.5-turbo', messages=messages, max_tokens=300,
+                                                       temperature=0.2, stream=True)
+            try:
+                for chunk in resp:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+            finally:
+                # closing the HTTP stream stops generation on the provider side
+                resp.close()
+        else:
+            resp = self.legacy.ChatCompletion.create(model='gpt-3.5-turbo', messages=messages, max_tokens=300, temperature=0.2,
+                                                     request_timeout=AI_DEADLINE, stream=True)
+            for chunk in resp:
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+
+class StubProvider(AIProvider):
+    """Local stand-in for a real provider: fixed reply, configurable latency and error rate."""
+    name = 'stub'
+
+    def __init__(self, reply=None, latency=0.0, error_rate=0.0, name='stub'):
+        super().__init__()
+        self.name = name
+        self.reply = reply
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+
+    def configured(self):
+        return True
+
+    def generate(self, message, role):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError('stub provider error')
+        return self.reply or f"(stub answer for {role}) {message}"
+
+    def stream(self, message, role):
+        words = self.generate(message, role).split(' ')
+        for i, w in enumerate(words):
+            yield w if i == 0 else ' ' + w
+
+class ProviderRegistry:
+    def __init__(self):
+        self.providers = []
+
+    def configure_from_env(self):
+        if os.getenv('AI_PROVIDER', '').lower() == 'stub':
+            self.providers = [StubProvider(latency=float(os.getenv('AI_STUB_LATENCY_MS', '0')) / 1000.0,
+                                           error_rate=float(os.getenv('AI_STUB_ERROR_RATE', '0')))]
+        else:
+            self.providers = [GeminiProvider(), OpenAIProvider()]
+        return self
+
+    def register(self, provider, first=True):
+        if first:
+            self.providers.insert(0, provider)
+        else:
+            self.providers.append(provider)
+        return provider
+
+    def replace(self, *providers):
+        """Use exactly these providers (e.g. a StubProvider in tests)."""
+        self.providers = list(providers)
+
+    def warm(self):
+        for p in self.providers:
+            p.warm()
+        return self
+
+    def available(self):
+        return [p for p in self.providers if p.usable()]
+
+    def get(self, name):
+        for p in self.providers:
+            if p.name == name:
+                return p
+        return None
+
+PROVIDERS = ProviderRegistry().configure_from_env()
+
+_AI_POOL = None
+_AI_POOL_PID = None
+_AI_POOL_LOCK = threading.Lock()
+
+def _ai_pool():
+    global _AI_POOL, _AI_POOL_PID
+    if _AI_POOL is None or _AI_POOL_PID != os.getpid():
+        with _AI_POOL_LOCK:
+            if _AI_POOL is None or _AI_POOL_PID != os.getpid():
+                _AI_POOL = ThreadPoolExecutor(max_workers=AI_POOL_SIZE, thread_name_prefix='ai-call')
+                _AI_POOL_PID = os.getpid()
+    return _AI_POOL
+
+class ProviderCall:
+    """One provider call submitted to the pool. Its outcome is recorded exactly once: by the
+    call when it finishes, or by the dispatcher when it abandons the call at the deadline
+    (the late result is then dropped and only frees the provider's abandoned slot)."""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.started = time.monotonic()
+        self.settled = False
+        self.abandoned = False
+        self._lock = threading.Lock()
+
+    def finish(self):
+        """Called by the worker when the provider returns; True if the outcome still counts."""
+        p = self.provider
+        with self._lock:
+            counts = not self.settled
+            self.settled = True
+            if self.abandoned:
+                with p._lock:
+                    p.abandoned -= 1
+        return counts
+
+    def abandon(self, running):
+        """Give up on the call; True if this decided its outcome (i.e. it hadn't finished)."""
+        p = self.provider
+        with self._lock:
+            if self.settled:
+                return False
+            self.settled = True
+            if running:
+                self.abandoned = True
+                with p._lock:
+                    p.abandoned += 1
+        return True
+
+def _provider_call(call, message, role):
+    p = call.provider
+    try:
+        ans = p.generate(message, role)
+    except Exception:
+        if call.finish():
+            p.breaker.failure()
+            METRICS.observe('mmec_provider_seconds', time.monotonic() - call.started, provider=p.name, outcome='error')
+        raise
+    if call.finish():
+        dt = time.monotonic() - call.started
+        p.latencies.add(dt)
+        p.breaker.success()
+        METRICS.observe('mmec_provider_seconds', dt, provider=p.name, outcome='ok')
+    return ans
+
+def call_gemini(message, role, timeout=None, exclude=()):
+    """Ask the configured AI providers (Gemini first, then OpenAI when external queries
+    are allowed) and return the text response, or an '[AI error]' / '[AI unavailable]' /
+    '[AI not configured]' marker string that api_query turns into a short message.
+    The whole chain is bounded by `timeout` (default AI_DEADLINE); see the dispatch
+    policy above for hedging and circuit breaking. Providers in `exclude` are skipped.
+    Keys come from GEMINI_API_KEY / OPENAI_API_KEY; clients are built once by PROVIDERS.
+    """
+    usable = [p for p in PROVIDERS.available() if p not in exclude]
+    if not usable:
+        # If nothing worked
+        return ("[AI not configured] No usable AI provider configured or external queries are disallowed. "
+                "Set OPENAI_API_KEY and ALLOW_EXTERNAL_QUERIES=1 or ensure GEMINI_API_KEY and google.generativeai are installed.")
+    deadline = time.monotonic() + (AI_DEADLINE if timeout is None else timeout)
+    pool = _ai_pool()
+    candidates = list(usable)
+    pending = {}  # future -> ProviderCall
+    failed = []
+
+    def launch():
+        # the breaker is asked only for the provider actually being called: allow() claims
+        # the half-open trial, which must always be followed by success() or failure()
+        while candidates:
+            p = candidates.pop(0)
+            if p.abandoned < AI_MAX_ABANDONED and p.breaker.allow():
+                call = ProviderCall(p)
+                pending[pool.submit(_provider_call, call, message, role)] = call
+                return True
+        return False
+
+    if not launch():
+        return "[AI unavailable] All AI providers are failing; circuit breakers are open."
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wait_for = deadline - now
+        hedge_at = None
+        if candidates and len(pending) == 1:
+            call = next(iter(pending.values()))
+            hedge_at = call.started + call.provider.hedge_delay()
+            wait_for = max(0.0, min(wait_for, hedge_at - now))
+        done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+        for fut in done:
+            p = pending.pop(fut).provider
+            try:
+                return fut.result()
             except Exception as e:
-                print('Gemini generate_text error:', e)
-        except Exception as e:
-            print('Gemini import/config error:', e)
+                print(f'{p.name} call error:', e)
+                failed.append(p.name)
+        if candidates and (not pending or (hedge_at is not None and time.monotonic() >= hedge_at)):
+            # fall back after a failure, or hedge a slow primary
+            launch()
+    for fut, call in pending.items():
+        # still running at the deadline: count it against the provider and stop waiting
+        p = call.provider
+        if call.abandon(running=not fut.cancel()):
+            print(f'{p.name} call timed out after deadline')
+            METRICS.observe('mmec_provider_seconds', time.monotonic() - call.started, provider=p.name, outcome='timeout')
+            p.breaker.failure()
+        failed.append(p.name)
+    return f"[AI error] Failed to call {', '.join(failed)}. Check server logs."
 
-    # Next: OpenAI fallback (if configured and allowed)
-    allow_external = is_external_allowed()
-    if openai_key and allow_external:
-        try:
-            import openai
-            openai.api_key = openai_key
-            system = "You are an assistant for Maratha Mandal Engineering College (MMEC). Answer college-related queries concisely and helpfully. If the user asks unrelated topics, say you only provide MMEC information."
-            resp = openai.ChatCompletion.create(
-                model='gpt-3.5-turbo',
-                messages=[{'role':'system','content':system},{'role':'user','content':message}],
-                max_tokens=300,
-                temperature=0.2
-            )
-            ans = resp.choices[0].message.content.strip()
-            if len(ans) > 600:
-                ans = ans[:590].rsplit('.',1)[0] + '.'
-            return ans
-        except Exception as e:
-            print('OpenAI call error:', e)
-            return "[AI error] Failed to call OpenAI. Check server logs."
 
-    # If nothing worked
-    return ("[AI not configured] No usable AI provider configured or external queries are disallowed. "
-            "Set OPENAI_API_KEY and ALLOW_EXTERNAL_QUERIES=1 or ensure GEMINI_API_KEY and google.generativeai are installed.")
+# Response cache for AI answers. Students ask the same few questions in slightly different
+# wording, so answers are keyed on the normalized query (case, punctuation, whitespace,
+# the MMEC expansion done in api_query and, with AI_CACHE_STOPWORDS=1, stopwords) plus
+# provider and role. Entries expire after AI_CACHE_TTL seconds and the in-memory LRU holds
+# AI_CACHE_SIZE of them; AI_CACHE_PERSIST=1 also keeps them in data/mmec.db across restarts.
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL', '21600'))
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', '2000'))
+AI_CACHE_PERSIST = os.getenv('AI_CACHE_PERSIST', '0').lower() in ('1', 'true', 'yes')
+AI_CACHE_STOPWORDS = os.getenv('AI_CACHE_STOPWORDS', '0').lower() in ('1', 'true', 'yes')
+
+def normalize_query(text, drop_stopwords=AI_CACHE_STOPWORDS):
+    q = (text or '').strip().casefold()
+    if 'mmec' in q:
+        q = q.replace('mmec', 'maratha mandal engineering college')
+    # keep letters, combining marks and digits of any script (\w alone would split
+    # Kannada/Devanagari words at their vowel signs); everything else separates words
+    q = ''.join(c if unicodedata.category(c)[0] in 'LMN' else ' ' for c in q)
+    words = q.split()
+    if drop_stopwords:
+        words = [w for w in words if w not in STOPWORDS] or words
+    return ' '.join(words)
+
+def ai_provider_name():
+    """Which provider call_gemini would try first (part of the cache key)."""
+    avail = PROVIDERS.available()
+    return avail[0].name if avail else 'none'
+
+class ResponseCache:
+    def __init__(self, maxsize, ttl, persist=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+        self._data = OrderedDict()  # key -> (expires_at wall clock, answer)
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self):
+        conn = DB.conn()
+        if not self._table_ready:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, answer TEXT, expires REAL)')
+            self._table_ready = True
+        return conn
+
+    def get(self, key):
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and hit[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                METRICS.inc('mmec_ai_cache_hits_total')
+                return hit[1]
+            if hit:
+                del self._data[key]
+        if self.persist:
+            try:
+                row = self._db().execute('SELECT answer, expires FROM ai_cache WHERE key=? AND expires>?', (key, now)).fetchone()
+            except Exception as e:
+                print('AI cache read error', e)
+                row = None
+            if row:
+                with self._lock:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                METRICS.inc('mmec_ai_cache_hits_total')
+                return row[0]
+        with self._lock:
+            self.misses += 1
+        METRICS.inc('mmec_ai_cache_misses_total')
+        return None
+
+    def _store(self, key, answer, expires):
+        self._data[key] = (expires, answer)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def put(self, key, answer):
+        if key is None:
+            return
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, answer, expires)
+        if self.persist:
+            try:
+                conn = self._db()
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO ai_cache (key, answer, expires) VALUES (?,?,?)', (key, answer, expires))
+            except Exception as e:
+                print('AI cache write error', e)
+
+    def clear(self):
+        with self._lock:
+            n = len(self._data)
+            self._data.clear()
+        if self.persist:
+            try:
+                conn = self._db()
+                with conn:
+                    conn.execute('DELETE FROM ai_cache')
+            except Exception as e:
+                print('AI cache clear error', e)
+        return n
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "max_size": self.maxsize, "ttl": self.ttl, "persist": self.persist,
+                    "hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
+
+AI_CACHE = ResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL, AI_CACHE_PERSIST)
+
+def ai_cache_key(message, role, msg_lower=None):
+    """None when the query has no words (only punctuation/emoji): such queries are never
+    cached or coalesced, since they would all share one key."""
+    q = normalize_query(msg_lower if msg_lower is not None else message)
+    return f"{ai_provider_name()}|{role}|{q}" if q else None
+
+# Single-flight: concurrent requests for the same cache key share one provider call.
+# The first caller runs it; the others wait (at most AI_DEADLINE + AI_SINGLEFLIGHT_SLACK
+# seconds) and get the same answer, marker string or exception.
+AI_SINGLEFLIGHT_SLACK = float(os.getenv('AI_SINGLEFLIGHT_SLACK', '1.0'))
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Join the in-flight call for `key`, or register a new one. Returns (call, leader);
+        the leader must call finish() when done. A streaming leader can publish() deltas
+        that streaming followers replay with follow(). A None key is never shared."""
+        if key is None:
+            return self._new_call(), True
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._new_call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        METRICS.inc('mmec_ai_singleflight_calls_total' if leader else 'mmec_ai_singleflight_coalesced_total')
+        return call, leader
+
+    @staticmethod
+    def _new_call():
+        return {'done': threading.Event(), 'result': None, 'error': None,
+                'deltas': [], 'streamed': False, 'cond': threading.Condition()}
+
+    def publish(self, call, piece):
+        with call['cond']:
+            call['deltas'].append(piece)
+            call['cond'].notify_all()
+
+    def finish(self, key, call, error=None):
+        if error is not None:
+            call['error'] = error
+        elif call['result'] is None:
+            # leader went away (client disconnect) before it had an answer: share what it streamed
+            call['result'] = ''.join(call['deltas']) or "[AI error] The request answering this question ended early."
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        with call['cond']:
+            call['done'].set()
+            call['cond'].notify_all()
+
+    def follow(self, call, timeout):
+        """Yield the leader's deltas (those already published first) until it finishes."""
+        end = time.monotonic() + timeout
+        seen = 0
+        while True:
+            with call['cond']:
+                while seen == len(call['deltas']) and not call['done'].is_set():
+                    left = end - time.monotonic()
+                    if left <= 0:
+                        raise TimeoutError(f'gave up waiting for in-flight AI call after {timeout:.1f}s')
+                    call['cond'].wait(left)
+                new = call['deltas'][seen:]
+                done = call['done'].is_set()
+            seen += len(new)
+            yield from new
+            if done:
+                break
+        if call['error'] is not None:
+            raise call['error']
+
+    def do(self, key, fn, timeout):
+        call, leader = self.begin(key)
+        if leader:
+            try:
+                call['result'] = fn()
+            except Exception as e:
+                self.finish(key, call, e)
+            else:
+                self.finish(key, call)
+        elif not call['done'].wait(timeout):
+            raise TimeoutError(f'gave up waiting for in-flight AI call after {timeout:.1f}s')
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "calls": self.leaders, "coalesced": self.coalesced}
+
+SINGLE_FLIGHT = SingleFlight()
+
+def cached_call_gemini(message, role, msg_lower=None):
+    key = ai_cache_key(message, role, msg_lower)
+    ans = AI_CACHE.get(key)
+    if ans is not None:
+        return ans
+    try:
+        ans = SINGLE_FLIGHT.do(key, lambda: call_gemini(message, role), AI_DEADLINE + AI_SINGLEFLIGHT_SLACK)
+    except Exception as e:
+        print('AI call error', e)
+        return "[AI error] Failed to get an answer. Check server logs."
+    # only real answers are cached; '[AI error]' / '[AI not configured]' must be retried
+    if isinstance(ans, str) and ans.strip() and not ans.startswith('[AI '):
+        AI_CACHE.put(key, ans)
+    return ans
 
 
 # Serve college information from data files
 @app.route('/api/college_info', methods=['GET'])
 def api_college_info():
     info_path = os.path.join('data', 'college_info', 'info.md')
-    if os.path.exists(info_path):
-        with open(info_path, 'r', encoding='utf-8') as f:
-            txt = f.read()
-        return jsonify({"ok": True, "text": txt})
+    resp = ASSETS.response(info_path, 'application/json',
+                           lambda raw: json.dumps({"ok": True, "text": raw.decode('utf-8')}).encode('utf-8'))
+    if resp is not None:
+        return resp
     return jsonify({"ok": False, "error": "info not found"}), 404
 
 
@@ -398,32 +2482,30 @@ def api_status():
     """
     gemini_key = bool(os.getenv('GEMINI_API_KEY'))
     openai_key = bool(os.getenv('OPENAI_API_KEY'))
-    # Check whether gemini client library is installed (so gemini is actually usable)
-    gemini_ready = False
-    if gemini_key:
-        try:
-            import importlib
-            importlib.import_module('google.generativeai')
-            gemini_ready = True
-        except Exception:
-            gemini_ready = False
-    usable = (openai_key and is_external_allowed()) or gemini_ready
+    # readiness comes from the registry's cached init state, not a fresh import probe
+    gemini = PROVIDERS.get('gemini')
+    gemini_ready = bool(gemini and gemini.warm())
+    external = is_external_allowed()
     return jsonify({
         "ok": True,
-        "ai_provider_available": usable,
+        "ai_provider_available": bool(PROVIDERS.available()),
         "openai_present": openai_key,
         "gemini_key_present": gemini_key,
         "gemini_ready": gemini_ready,
-        "external_allowed": is_external_allowed()
+        "external_allowed": external,
+        "providers": [{"name": p.name, "ready": p.warm(), "breaker": p.breaker.state} for p in PROVIDERS.providers],
+        "ai_cache": AI_CACHE.stats(),
+        "ai_singleflight": SINGLE_FLIGHT.stats()
     })
 
 
 @app.route('/api/class_strengths', methods=['GET'])
 def api_class_strengths():
     p = os.path.join('data', 'college_info', 'class_strengths.json')
-    if os.path.exists(p):
-        with open(p, 'r', encoding='utf-8') as f:
-            return jsonify({"ok": True, "data": json.load(f)})
+    resp = ASSETS.response(p, 'application/json',
+                           lambda raw: json.dumps({"ok": True, "data": json.loads(raw)}).encode('utf-8'))
+    if resp is not None:
+        return resp
     return jsonify({"ok": False, "error": "not found"}), 404
 
 
@@ -434,153 +2516,797 @@ os.makedirs(HIST_DIR, exist_ok=True)
 # Optional SQLite DB (created by migration script)
 DB_PATH = os.path.join('data', 'mmec.db')
 
+# Data-access layer: each thread uses one connection at a time (re-opened after a fork), WAL
+# journaling so readers don't block the writer, tuned pragmas and sqlite3's per-connection
+# prepared-statement cache. Request threads hand their connection back to a small idle pool
+# when the request ends (the dev server starts a thread per request), so at most
+# DB_POOL_SIZE idle connections stay open. The schema is checked once at startup, not per request.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=67108864',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+HISTORY_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_histories_username_id ON histories (username, id)'
+
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self.ready = False
+        self._local = threading.local()
+        self._all = []
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def conn(self):
+        c = getattr(self._local, 'conn', None)
+        if c is None or self._local.pid != os.getpid():
+            with self._lock:
+                c = self._idle.pop() if self._same_process() and self._idle else None
+            if c is None:
+                c = sqlite3.connect(self.path, timeout=5.0, cached_statements=256, check_same_thread=False)
+                for pragma in DB_PRAGMAS:
+                    c.execute(pragma)
+                with self._lock:
+                    self._all.append(c)
+            self._local.conn = c
+            self._local.pid = os.getpid()
+        return c
+
+    def _same_process(self):
+        # connections opened before a fork belong to the parent: start over (lock held)
+        if self._pid != os.getpid():
+            self._idle, self._all, self._pid = [], [], os.getpid()
+            return False
+        return True
+
+    def release(self):
+        """Give this thread's connection back to the idle pool (closing it if the pool is full)."""
+        c = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if c is None or self._local.pid != os.getpid():
+            return
+        if c.in_transaction:
+            c.rollback()
+        with self._lock:
+            if self._same_process() and len(self._idle) < DB_POOL_SIZE:
+                self._idle.append(c)
+                return
+            if c in self._all:
+                self._all.remove(c)
+        c.close()
+
+    def check_schema(self):
+        """Decide once whether the DB can serve histories (file exists and has the table)."""
+        self.ready = False
+        if not os.path.exists(self.path):
+            return False
+        try:
+            conn = self.conn()
+            row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='histories'").fetchone()
+            if row is not None:
+                # keyset pagination relies on this index; older DBs get it here once
+                with conn:
+                    conn.execute(HISTORY_INDEX_SQL)
+            self.ready = row is not None
+        except Exception as e:
+            print('DB schema check error', e)
+        return self.ready
+
+    def close_all(self):
+        with self._lock:
+            conns, self._all, self._idle = self._all, [], []
+        for c in conns:
+            try:
+                c.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+DB = Database(DB_PATH)
+DB.check_schema()
+
 def db_available():
-    return os.path.exists(DB_PATH)
-
-def db_get_history(username, page, size):
-    # returns list of items latest-first for compatibility
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    offset = (page-1)*size
-    cur.execute('SELECT sender, text, ts FROM histories WHERE username=? ORDER BY id DESC LIMIT ? OFFSET ?', (username, size, offset))
-    rows = cur.fetchall()
-    conn.close()
+    return DB.ready
+
+@app.teardown_appcontext
+def _release_db(exc=None):
+    DB.release()
+
+# Login sessions: token -> username with a TTL that slides forward on use (SESSION_TTL
+# seconds of inactivity). The sqlite backend keeps them in data/mmec.db so a token works on
+# every worker; each process fronts it with a small read-through cache, so a lookup is a dict
+# hit most of the time and deletions/expiry propagate within SESSION_CACHE_SECONDS. The memory
+# backend only suits a single process. Expired tokens are swept at most once per
+# SESSION_SWEEP_INTERVAL, piggybacked on logins (the only thing that grows the store).
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite').lower()
+SESSION_TTL = float(os.getenv('SESSION_TTL', '28800'))
+SESSION_CACHE_SECONDS = float(os.getenv('SESSION_CACHE_SECONDS', '5'))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '60'))
+SESSION_CACHE_MAX = 10000
+
+class SessionStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # stored expiries are pushed forward at most this often per token
+        self.touch_interval = min(60.0, ttl / 10.0)
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def create(self, username):
+        token = str(uuid.uuid4())
+        now = time.time()
+        self._put(token, username, now + self.ttl)
+        if now - self._last_sweep >= SESSION_SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.sweep(now)
+        return token
+
+    def get(self, token):
+        """Username for a live token (and slide its expiry), else None."""
+        if not token:
+            return None
+        now = time.time()
+        found = self._lookup(token, now)
+        if found is None:
+            return None
+        username, expires = found
+        if expires <= now:
+            self.delete(token)
+            return None
+        if expires - now < self.ttl - self.touch_interval:
+            self._touch(token, username, now + self.ttl)
+        return username
+
+class MemorySessionStore(SessionStore):
+    name = 'memory'
+
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self._sessions = {}
+
+    def _put(self, token, username, expires):
+        self._sessions[token] = (username, expires)
+
+    def _lookup(self, token, now):
+        return self._sessions.get(token)
+
+    _touch = _put
+
+    def delete(self, token):
+        self._sessions.pop(token, None)
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            dead = [t for t, (_, exp) in list(self._sessions.items()) if exp <= now]
+            for t in dead:
+                self._sessions.pop(t, None)
+        return len(dead)
+
+    def count(self):
+        return len(self._sessions)
+
+class SqliteSessionStore(SessionStore):
+    name = 'sqlite'
+
+    def __init__(self, db, ttl, cache_seconds):
+        super().__init__(ttl)
+        self.db = db
+        self.cache_seconds = cache_seconds
+        self._cache = {}   # token -> (username, expires, cached_until)
+        conn = db.conn()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, username TEXT NOT NULL, expires REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)')
+
+    def _remember(self, token, username, expires, now):
+        if len(self._cache) >= SESSION_CACHE_MAX:
+            self._cache.clear()
+        self._cache[token] = (username, expires, now + self.cache_seconds)
+
+    def _put(self, token, username, expires):
+        conn = self.db.conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (token, username, expires) VALUES (?, ?, ?)', (token, username, expires))
+        self._remember(token, username, expires, time.time())
+
+    def _lookup(self, token, now):
+        hit = self._cache.get(token)
+        if hit is not None and now < hit[2]:
+            return hit[0], hit[1]
+        row = self.db.conn().execute('SELECT username, expires FROM sessions WHERE token = ?', (token,)).fetchone()
+        if row is None:
+            self._cache.pop(token, None)
+            return None
+        self._remember(token, row[0], row[1], now)
+        return row[0], row[1]
+
+    def _touch(self, token, username, expires):
+        conn = self.db.conn()
+        with conn:
+            conn.execute('UPDATE sessions SET expires = ? WHERE token = ?', (expires, token))
+        self._remember(token, username, expires, time.time())
+
+    def delete(self, token):
+        self._cache.pop(token, None)
+        conn = self.db.conn()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        for t, (_, exp, until) in list(self._cache.items()):
+            if exp <= now or until <= now:
+                self._cache.pop(t, None)
+        conn = self.db.conn()
+        with conn:
+            return conn.execute('DELETE FROM sessions WHERE expires <= ?', (now,)).rowcount
+
+    def count(self):
+        return self.db.conn().execute('SELECT COUNT(*) FROM sessions WHERE expires > ?', (time.time(),)).fetchone()[0]
+
+def make_session_store():
+    if SESSION_BACKEND == 'sqlite':
+        try:
+            return SqliteSessionStore(DB, SESSION_TTL, SESSION_CACHE_SECONDS)
+        except Exception as e:
+            print('Session DB unavailable, keeping sessions in memory:', e)
+    return MemorySessionStore(SESSION_TTL)
+
+SESSIONS = make_session_store()
+
+def db_get_history(username, size, before_id=None, page=1):
+    """Return (items latest-first, next_cursor, total). With before_id this is a keyset
+    seek on (username, id); page is only used by legacy offset callers."""
+    conn = DB.conn()
+    if before_id is not None:
+        rows = conn.execute('SELECT id, sender, text, ts FROM histories WHERE username=? AND id<? ORDER BY id DESC LIMIT ?', (username, before_id, size)).fetchall()
+    else:
+        offset = (page-1)*size
+        rows = conn.execute('SELECT id, sender, text, ts FROM histories WHERE username=? ORDER BY id DESC LIMIT ? OFFSET ?', (username, size, offset)).fetchall()
+    total = conn.execute('SELECT COUNT(*) FROM histories WHERE username=?', (username,)).fetchone()[0]
     out = []
-    for sender, text, ts in rows:
-        out.append({'from': sender or 'user', 'text': text or '', 'ts': ts})
-    return out
+    for hid, sender, text, ts in rows:
+        out.append({'id': hid, 'from': sender or 'user', 'text': text or '', 'ts': ts})
+    next_cursor = out[-1]['id'] if out and len(out) == size else None
+    return out, next_cursor, total
+
+def db_append_histories(records):
+    """Insert [(username, item), ...] in one transaction."""
+    conn = DB.conn()
+    with conn:
+        conn.executemany('INSERT INTO histories (username, role, sender, text, ts) VALUES (?,?,?,?,?)', [
+            (username, username, item.get('from','user'), item.get('text',''), item.get('ts', datetime.utcnow().isoformat() + 'Z'))
+            for username, item in records
+        ])
 
 def db_append_history(username, item):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('INSERT INTO histories (username, role, sender, text, ts) VALUES (?,?,?,?,?)', (
-        username, username, item.get('from','user'), item.get('text',''), item.get('ts', datetime.utcnow().isoformat() + 'Z')
-    ))
-    conn.commit()
-    conn.close()
+    db_append_histories([(username, item)])
 
 def db_clear_history(username):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('DELETE FROM histories WHERE username=?', (username,))
-    conn.commit()
-    conn.close()
+    conn = DB.conn()
+    with conn:
+        conn.execute('DELETE FROM histories WHERE username=?', (username,))
 
 
 def history_path(username):
     safe = username.replace('/', '_')
     return os.path.join(HIST_DIR, f'{safe}.json')
 
+# JSON fallback (no data/mmec.db): each user's history is an append-only JSON Lines file
+# <user>.jsonl plus a sidecar <user>.idx of little-endian uint64 line offsets, so an
+# append is one write to each and the latest-N page is an index seek plus one read from
+# near the end. Legacy <user>.json arrays are upgraded on first touch (kept as .json.bak).
+_IDX = struct.Struct('<Q')
+
+class JsonlHistoryStore:
+    def __init__(self, base):
+        self.base = base
+        self._checked = set()
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def paths(self, username):
+        stem = history_path(username)[:-len('.json')]
+        return stem + '.jsonl', stem + '.idx', stem + '.json'
+
+    def _lock(self, username):
+        with self._guard:
+            return self._locks.setdefault(username, threading.Lock())
+
+    def _prepare(self, username):
+        """Upgrade a legacy file and verify the sidecar once per process (caller holds the
+        thread lock). Other workers may be doing the same, so the upgrade runs under an fcntl
+        lock on the legacy file and the rebuild under the data file's append lock, each
+        re-checked once the lock is held."""
+        if username in self._checked:
+            return
+        data_p, idx_p, legacy_p = self.paths(username)
+        if not os.path.exists(data_p) and os.path.exists(legacy_p):
+            try:
+                with _flocked(legacy_p):
+                    if not os.path.exists(data_p):
+                        self._upgrade(legacy_p, data_p, idx_p)
+            except FileNotFoundError:
+                pass   # another worker finished the upgrade and renamed it to .bak
+        if os.path.exists(data_p) and not self._index_ok(data_p, idx_p):
+            with _flocked(data_p, 'ab'):
+                if not self._index_ok(data_p, idx_p):
+                    self._rebuild_index(data_p, idx_p)
+        self._checked.add(username)
+
+    def _upgrade(self, legacy_p, data_p, idx_p):
+        try:
+            with open(legacy_p, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except Exception as e:
+            print('History upgrade read error', legacy_p, e)
+            items = []
+        offsets = []
+        pos = 0
+        tmp = f'{data_p}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            for item in items if isinstance(items, list) else []:
+                line = (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+                offsets.append(pos)
+                pos += len(line)
+                f.write(line)
+        with open(idx_p, 'wb') as f:
+            f.write(b''.join(_IDX.pack(o) for o in offsets))
+        os.replace(tmp, data_p)
+        os.replace(legacy_p, legacy_p + '.bak')
+
+    def _index_ok(self, data_p, idx_p):
+        if not os.path.exists(idx_p):
+            return False
+        isize = os.path.getsize(idx_p)
+        dsize = os.path.getsize(data_p)
+        if isize % _IDX.size:
+            return False
+        if isize == 0:
+            return dsize == 0
+        with open(idx_p, 'rb') as f:
+            f.seek(isize - _IDX.size)
+            last = _IDX.unpack(f.read(_IDX.size))[0]
+        if last >= dsize:
+            return False
+        with open(data_p, 'rb') as f:
+            f.seek(last)
+            tail = f.read()
+        # exactly one complete line after the last indexed offset
+        return tail.count(b'\n') == 1 and tail.endswith(b'\n')
+
+    def _rebuild_index(self, data_p, idx_p):
+        offsets = []
+        pos = 0
+        good = 0
+        with open(data_p, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    offsets.append(pos)
+                    good = pos + len(line)
+                pos += len(line)
+        if good != pos:
+            # drop a torn trailing write
+            os.truncate(data_p, good)
+        with open(idx_p, 'wb') as f:
+            f.write(b''.join(_IDX.pack(o) for o in offsets))
+
+    def append_many(self, username, items):
+        data_p, idx_p, _ = self.paths(username)
+        blob = [(json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8') for item in items]
+        with self._lock(username):
+            self._prepare(username)
+            with _flocked(data_p, 'ab') as f:
+                f.write(b''.join(blob))
+                f.flush()
+                pos = f.tell() - sum(len(b) for b in blob)
+                offsets = []
+                for b in blob:
+                    offsets.append(pos)
+                    pos += len(b)
+                with open(idx_p, 'ab') as fi:
+                    fi.write(b''.join(_IDX.pack(o) for o in offsets))
+
+    def page(self, username, size, before_id=None, page=1):
+        """Return (items latest-first with 1-based ids, next_cursor, total)."""
+        data_p, idx_p, _ = self.paths(username)
+        with self._lock(username):
+            self._prepare(username)
+            if not os.path.exists(data_p):
+                return [], None, 0
+            total = os.path.getsize(idx_p) // _IDX.size
+            end = min(before_id - 1, total) if before_id is not None else total - (page-1)*size
+            start = max(0, end - size)
+            if end <= start:
+                return [], None, total
+            # offsets of lines start..end, plus the next line's start when there is one
+            with open(idx_p, 'rb') as f:
+                f.seek(start * _IDX.size)
+                raw = f.read((min(end + 1, total) - start) * _IDX.size)
+            first = _IDX.unpack_from(raw, 0)[0]
+            with open(data_p, 'rb') as f:
+                f.seek(first)
+                if end < total:
+                    chunk = f.read(_IDX.unpack_from(raw, (end - start) * _IDX.size)[0] - first)
+                else:
+                    chunk = f.read()
+        lines = chunk.split(b'\n')[:end - start]
+        items = []
+        for i in range(len(lines) - 1, -1, -1):
+            try:
+                item = json.loads(lines[i])
+            except Exception:
+                item = {'from': 'user', 'text': ''}
+            items.append(dict(item, id=start + i + 1))
+        next_cursor = start + 1 if start > 0 else None
+        return items, next_cursor, total
+
+    def clear(self, username):
+        with self._lock(username):
+            for p in self.paths(username) + (self.paths(username)[2] + '.bak',):
+                if os.path.exists(p):
+                    os.remove(p)
+            self._checked.discard(username)
+
+JSON_HISTORY = JsonlHistoryStore(HIST_DIR)
+
+def json_append_histories(records):
+    """JSON fallback: one append per user per batch."""
+    by_user = {}
+    for username, item in records:
+        by_user.setdefault(username, []).append(item)
+    for username, items in by_user.items():
+        JSON_HISTORY.append_many(username, items)
+
+def write_history_batch(records):
+    if db_available():
+        with METRICS.timed('mmec_storage_seconds', op='history_write_batch', backend='sqlite'):
+            db_append_histories(records)
+    else:
+        with METRICS.timed('mmec_storage_seconds', op='history_write_batch', backend='jsonl'):
+            json_append_histories(records)
+
+# Group commit for history appends. Requests hand their records to one background writer
+# per process, which drains the bounded queue into batches (HISTORY_BATCH_SIZE records or
+# HISTORY_FLUSH_MS after the first one) and writes each batch in a single transaction.
+# HISTORY_DURABILITY: 'group' (default) waits for the batch commit before answering,
+# 'async' answers once queued (write-behind), 'sync' writes inline as before.
+HISTORY_DURABILITY = os.getenv('HISTORY_DURABILITY', 'group').lower()
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '256'))
+HISTORY_FLUSH_MS = float(os.getenv('HISTORY_FLUSH_MS', '5'))
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', '10000'))
+HISTORY_PAGE_MAX = int(os.getenv('HISTORY_PAGE_MAX', '200'))
+
+class HistoryWriter:
+    def __init__(self, write_batch, mode, max_batch, flush_ms, maxsize):
+        self.write_batch = write_batch
+        self.mode = mode
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.q = queue.Queue(maxsize)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # started lazily (and again after a fork) so preloading the app doesn't leak threads
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                    if self._pid != os.getpid():
+                        self.q = queue.Queue(self.q.maxsize)
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, records, timeout=5.0):
+        """Queue [(username, item), ...]. Raises queue.Full if the writer can't keep up,
+        or the write error itself in 'group' mode, where TimeoutError means the batch
+        wasn't committed within `timeout` (it may still be written)."""
+        if not records:
+            return
+        if self.mode == 'sync':
+            self.write_batch(records)
+            return
+        self._ensure_thread()
+        ticket = {'done': threading.Event(), 'error': None}
+        self.q.put((records, ticket), timeout=timeout)
+        if self.mode == 'group':
+            if not ticket['done'].wait(timeout):
+                raise TimeoutError(f'history batch not committed after {timeout:.1f}s')
+            if ticket['error'] is not None:
+                raise ticket['error']
+
+    def flush(self, timeout=10.0):
+        """Block until everything queued so far has been written."""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        ticket = {'done': threading.Event(), 'error': None}
+        self.q.put((None, ticket), timeout=timeout)
+        ticket['done'].wait(timeout)
+
+    def _run(self):
+        while True:
+            entries = [self.q.get()]
+            count = len(entries[0][0] or [])
+            deadline = time.monotonic() + self.flush_interval
+            while count < self.max_batch and entries[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self.q.get(timeout=remaining) if remaining > 0 else self.q.get_nowait()
+                except queue.Empty:
+                    break
+                entries.append(nxt)
+                count += len(nxt[0] or [])
+            records = [r for recs, _ in entries if recs for r in recs]
+            error = None
+            if records:
+                try:
+                    self.write_batch(records)
+                except Exception as e:
+                    print('History batch write error', len(records), e)
+                    error = e
+            for recs, ticket in entries:
+                if recs is not None:
+                    ticket['error'] = error
+                ticket['done'].set()
+
+HISTORY_WRITER = HistoryWriter(write_history_batch, HISTORY_DURABILITY, HISTORY_BATCH_SIZE, HISTORY_FLUSH_MS, HISTORY_QUEUE_SIZE)
+atexit.register(HISTORY_WRITER.flush)
+
 
 @app.route('/api/history', methods=['GET','POST','DELETE'])
 def api_history():
-    # GET: ?user=Student&page=1&size=20
+    # GET: ?user=Student&size=20&before_id=<next_cursor> (legacy: &page=N)
+    # Items come back latest-first, each with an id; pass next_cursor as before_id for older ones.
     if request.method == 'GET':
         user = request.args.get('user', 'guest')
-        page = int(request.args.get('page', '1'))
-        size = int(request.args.get('size', '20'))
+        try:
+            page = int(request.args.get('page', '1'))
+            size = int(request.args.get('size', '20'))
+            before_id = request.args.get('before_id')
+            before_id = int(before_id) if before_id else None
+        except ValueError:
+            return jsonify({"ok": False, "error": "bad page or cursor"}), 400
+        # size 0 would index an empty page and -1 means "no LIMIT" to sqlite
+        if not 1 <= size <= HISTORY_PAGE_MAX:
+            return jsonify({"ok": False, "error": f"size must be between 1 and {HISTORY_PAGE_MAX}"}), 400
+        if page < 1 or (before_id is not None and before_id < 1):
+            return jsonify({"ok": False, "error": "bad page or cursor"}), 400
         # If SQLite DB available, use it for histories
         if db_available():
-            items = db_get_history(user, page, size)
-            # estimate total is unknown here; client uses emptiness to stop
-            return jsonify({"ok": True, "history": items, "page": page, "size": size})
-        # else fallback to JSON file storage
-        p = history_path(user)
-        if not os.path.exists(p):
-            return jsonify({"ok": True, "history": [], "page": page, "size": size})
-        with open(p, 'r', encoding='utf-8') as f:
-            hist = json.load(f)
-        # return paginated (latest first)
-        hist.reverse()
-        start = (page-1)*size
-        end = start + size
-        page_items = hist[start:end]
-        return jsonify({"ok": True, "history": page_items, "page": page, "size": size, "total": len(hist)})
-
-    # POST: append history item {user, from, text, ts}
+            with METRICS.timed('mmec_storage_seconds', op='history_get', backend='sqlite'):
+                items, next_cursor, total = db_get_history(user, size, before_id, page)
+            return jsonify({"ok": True, "history": items, "page": page, "size": size, "total": total, "next_cursor": next_cursor})
+        # else fallback to the per-user JSON Lines files; ids are 1-based line numbers
+        with METRICS.timed('mmec_storage_seconds', op='history_get', backend='jsonl'):
+            page_items, next_cursor, total = JSON_HISTORY.page(user, size, before_id, page)
+        return jsonify({"ok": True, "history": page_items, "page": page, "size": size, "total": total, "next_cursor": next_cursor})
+
+    # POST: append history item {user, from, text, ts}, or a batch: a list of such items
+    # or {user, items: [{from, text, ts}, ...]}
     if request.method == 'POST':
-        data = request.get_json() or {}
-        user = data.get('user', 'guest')
-        item = { 'from': data.get('from','user'), 'text': data.get('text',''), 'ts': data.get('ts') or datetime.utcnow().isoformat() + 'Z' }
-        # Use DB if available
-        if db_available():
-            try:
-                db_append_history(user, item)
-                return jsonify({"ok": True})
-            except Exception as e:
-                print('DB append history error', e)
-                return jsonify({"ok": False, "error": "db error"}), 500
-        # Fallback to JSON file
-        p = history_path(user)
-        lst = []
-        if os.path.exists(p):
-            with open(p, 'r', encoding='utf-8') as f:
-                try:
-                    lst = json.load(f)
-                except Exception:
-                    lst = []
-        lst.append(item)
-        with open(p, 'w', encoding='utf-8') as f:
-            json.dump(lst, f, indent=2)
-        return jsonify({"ok": True})
+        data = request.get_json(silent=True)
+        if data is None:
+            return jsonify({"ok": False, "error": "expected a JSON history item or list of items"}), 400
+        if isinstance(data, list):
+            raw = data
+        elif isinstance(data, dict) and isinstance(data.get('items'), list):
+            raw = [dict(i, user=i.get('user', data.get('user', 'guest'))) for i in data['items'] if isinstance(i, dict)]
+        else:
+            raw = [data]
+        records = []
+        for d in raw:
+            if not isinstance(d, dict):
+                continue
+            item = { 'from': d.get('from','user'), 'text': d.get('text',''), 'ts': d.get('ts') or datetime.utcnow().isoformat() + 'Z' }
+            records.append((d.get('user', 'guest'), item))
+        if not records:
+            return jsonify({"ok": False, "error": "no history items"}), 400
+        try:
+            with METRICS.timed('mmec_storage_seconds', op='history_append', backend=HISTORY_WRITER.mode):
+                HISTORY_WRITER.submit(records)
+        except (queue.Full, TimeoutError):
+            return jsonify({"ok": False, "error": "busy"}), 503
+        except Exception as e:
+            print('Append history error', e)
+            return jsonify({"ok": False, "error": "db error" if db_available() else "write error"}), 500
+        return jsonify({"ok": True, "count": len(records)})
 
     # DELETE: clear user history (expects JSON { user: 'Student' })
     if request.method == 'DELETE':
         data = request.get_json() or {}
         user = data.get('user', 'guest')
+        # don't let queued appends land after the clear
+        HISTORY_WRITER.flush()
         if db_available():
             try:
-                db_clear_history(user)
+                with METRICS.timed('mmec_storage_seconds', op='history_clear', backend='sqlite'):
+                    db_clear_history(user)
                 return jsonify({"ok": True})
             except Exception as e:
                 print('DB clear history error', e)
                 return jsonify({"ok": False, "error": "db error"}), 500
-        p = history_path(user)
-        if os.path.exists(p):
-            os.remove(p)
+        with METRICS.timed('mmec_storage_seconds', op='history_clear', backend='jsonl'):
+            JSON_HISTORY.clear(user)
         return jsonify({"ok": True})
 
 
-@app.route('/api/reports/class_strengths', methods=['GET'])
-def api_class_strengths_report():
-    # Try to generate a simple PDF report if reportlab available; otherwise return JSON
-    p = os.path.join('data', 'college_info', 'class_strengths.json')
-    if not os.path.exists(p):
+# PDF reports rendered from college data files. A report's identity is the hash of its
+# source file plus its template version: the PDF is built once per identity, written to
+# data/reports/ (so restarts and other workers reuse it) and kept in memory, then served
+# with an ETag and Range support. An admin upload of a source file rebuilds its reports in
+# the background. New reports only need a @REPORTS.register(...) render function.
+REPORT_DIR = os.path.join('data', 'reports')
+
+class Report:
+    def __init__(self, name, source, version, render, download_name):
+        self.name = name
+        self.source = source
+        self.version = version
+        self.render = render
+        self.download_name = download_name
+        self.stat_key = None    # (mtime_ns, size) the digest was computed for
+        self.digest = None
+        self.body = None        # PDF bytes for self.digest
+        self.lock = threading.Lock()
+
+class ReportRegistry:
+    def __init__(self, directory):
+        self.directory = directory
+        self.reports = {}
+
+    def register(self, name, source, version, download_name=None):
+        def deco(render):
+            self.reports[name] = Report(name, source, version, render, download_name or f'{name}.pdf')
+            return render
+        return deco
+
+    def _digest(self, rep):
+        st = os.stat(rep.source)
+        key = (st.st_mtime_ns, st.st_size)
+        if rep.stat_key != key:
+            with open(rep.source, 'rb') as f:
+                h = hashlib.sha256(f.read())
+            h.update(rep.version.encode('utf-8'))
+            rep.digest, rep.stat_key = h.hexdigest()[:24], key
+        return rep.digest
+
+    def _path(self, rep, digest):
+        return os.path.join(self.directory, f'{rep.name}-{digest}.pdf')
+
+    def get(self, name):
+        """(pdf_bytes, etag) for the report's current source. Raises FileNotFoundError if the
+        source is missing and whatever render raises (e.g. ImportError without reportlab)."""
+        rep = self.reports[name]
+        digest = self._digest(rep)
+        if rep.body is not None and rep.body[0] == digest:
+            return rep.body[1], digest
+        with rep.lock:
+            digest = self._digest(rep)
+            if rep.body is not None and rep.body[0] == digest:
+                return rep.body[1], digest
+            path = self._path(rep, digest)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    pdf = f.read()
+            else:
+                with open(rep.source, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                with METRICS.timed('mmec_stage_seconds', stage='report_' + name):
+                    pdf = rep.render(data)
+                os.makedirs(self.directory, exist_ok=True)
+                tmp = f'{path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(pdf)
+                os.replace(tmp, path)
+                # drop PDFs of older source versions
+                for old in os.listdir(self.directory):
+                    if old.startswith(name + '-') and old.endswith('.pdf') and old != os.path.basename(path):
+                        try:
+                            os.remove(os.path.join(self.directory, old))
+                        except OSError:
+                            pass
+            rep.body = (digest, pdf)
+        return pdf, digest
+
+    def source_changed(self, filename):
+        """Rebuild, in the background, every report built from data/college_info/<filename>."""
+        for rep in self.reports.values():
+            if os.path.basename(rep.source) == filename:
+                threading.Thread(target=self._rebuild, args=(rep.name,), daemon=True).start()
+
+    def _rebuild(self, name):
+        try:
+            self.get(name)
+        except Exception as e:
+            print('report rebuild error', name, e)
+
+REPORTS = ReportRegistry(REPORT_DIR)
+
+@REPORTS.register('class_strengths', os.path.join('data', 'college_info', 'class_strengths.json'), version='1')
+def render_class_strengths(data):
+    # Dynamically import reportlab modules to avoid static import errors when package is not installed
+    rl_pages = importlib.import_module('reportlab.lib.pagesizes')
+    rl_canvas_mod = importlib.import_module('reportlab.pdfgen.canvas')
+    letter = rl_pages.letter
+    Canvas = rl_canvas_mod.Canvas
+    buf = io.BytesIO()
+    c = Canvas(buf, pagesize=letter)
+    c.setFont('Helvetica-Bold', 14)
+    c.drawString(72, 720, 'Class Strengths Report - MMEC')
+    y = 700
+    c.setFont('Helvetica', 11)
+    for dept, vals in data.items():
+        if dept == 'faculty_head' or dept == 'faculty_count_other_depts':
+            continue
+        c.drawString(72, y, f'{dept}:')
+        y -= 16
+        for k, v in vals.items():
+            c.drawString(92, y, f'{k}: {v}')
+            y -= 14
+        y -= 8
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+@app.route('/api/reports/<name>', methods=['GET'])
+def api_report(name):
+    # Serve the cached PDF if reportlab is available; otherwise return the source JSON
+    rep = REPORTS.reports.get(name)
+    if rep is None or not os.path.exists(rep.source):
         return jsonify({"ok": False, "error": "not found"}), 404
-    with open(p, 'r', encoding='utf-8') as f:
-        data = json.load(f)
     try:
-        import importlib
-        # Dynamically import reportlab modules to avoid static import errors when package is not installed
-        rl_pages = importlib.import_module('reportlab.lib.pagesizes')
-        rl_canvas_mod = importlib.import_module('reportlab.pdfgen.canvas')
-        from io import BytesIO
-        letter = rl_pages.letter
-        Canvas = rl_canvas_mod.Canvas
-        buf = BytesIO()
-        c = Canvas(buf, pagesize=letter)
-        c.setFont('Helvetica-Bold', 14)
-        c.drawString(72, 720, 'Class Strengths Report - MMEC')
-        y = 700
-        c.setFont('Helvetica', 11)
-        for dept, vals in data.items():
-            if dept == 'faculty_head' or dept == 'faculty_count_other_depts':
-                continue
-            c.drawString(72, y, f'{dept}:')
-            y -= 16
-            for k, v in vals.items():
-                c.drawString(92, y, f'{k}: {v}')
-                y -= 14
-            y -= 8
-        c.showPage()
-        c.save()
-        buf.seek(0)
-        return send_file(buf, mimetype='application/pdf', download_name='class_strengths.pdf')
+        pdf, etag = REPORTS.get(name)
     except Exception as e:
         # reportlab not installed or failed, return JSON instead
-        return jsonify({"ok": True, "data": data})
+        with open(rep.source, 'r', encoding='utf-8') as f:
+            return jsonify({"ok": True, "data": json.load(f)})
+    resp = Response(pdf, mimetype='application/pdf')
+    resp.headers['Content-Disposition'] = f'attachment; filename={rep.download_name}'
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(pdf))
 
 
+# Admin uploads are staged next to data/college_info, validated, fsynced and renamed over
+# the live file in one step, so a concurrent reader sees either the old or the new file.
+# The corpus then reloads just that file and the next index generation re-tokenizes only
+# its documents before being swapped in.
+UPLOAD_STAGING_DIR = os.path.join('data', 'upload_staging')
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(5 * 1024 * 1024)))
+UPLOAD_MAX_TEXT_BYTES = int(os.getenv('UPLOAD_MAX_TEXT_BYTES', str(1024 * 1024)))
+
+def validate_college_file(name, path):
+    """Return why a staged upload can't go live, or None if it can."""
+    size = os.path.getsize(path)
+    if size > UPLOAD_MAX_BYTES:
+        return f'file too large ({size} bytes, limit {UPLOAD_MAX_BYTES})'
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in ('.json', '.md', '.txt'):
+        return None
+    if ext != '.json' and size > UPLOAD_MAX_TEXT_BYTES:
+        return f'text file too large ({size} bytes, limit {UPLOAD_MAX_TEXT_BYTES})'
+    with open(path, 'rb') as fh:
+        raw = fh.read()
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return 'file is not UTF-8 text'
+    if ext == '.json':
+        try:
+            json.loads(text)
+        except ValueError as e:
+            return f'invalid JSON: {e}'
+    return None
+
 @app.route('/api/admin/upload', methods=['POST','GET'])
 def api_admin_upload():
     """Authenticated admin upload and list endpoint.
@@ -607,13 +3333,34 @@ def api_admin_upload():
     if not f or not target:
         return jsonify({"ok": False, "error": "no file"}), 400
     safe = os.path.basename(target)
+    if not safe or safe.startswith('.'):
+        return jsonify({"ok": False, "error": "bad file name"}), 400
     dest = os.path.join(base, safe)
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    staged = os.path.join(UPLOAD_STAGING_DIR, f'{uuid.uuid4().hex}-{safe}')
     try:
-        f.save(dest)
-        return jsonify({"ok": True, "file": safe})
+        # fsync through the handle that wrote it (Windows refuses fsync on a read-only one)
+        with open(staged, 'wb') as out:
+            f.save(out)
+            out.flush()
+            os.fsync(out.fileno())
+        error = validate_college_file(safe, staged)
+        if error:
+            return jsonify({"ok": False, "error": error}), 400
+        os.replace(staged, dest)
+        before = CORPUS.version
+        CORPUS.invalidate(safe)
+        idx = get_college_index(wait=True)
+        REPORTS.source_changed(safe)
+        # an upload the index doesn't read (e.g. an image) leaves the generation as it was
+        reindexed = idx.rebuilt if CORPUS.version != before else []
+        return jsonify({"ok": True, "file": safe, "generation": idx.version, "reindexed": reindexed})
     except Exception as e:
         print('admin upload error', e)
         return jsonify({"ok": False, "error": "failed"}), 500
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
 
 
 @app.route('/api/admin/toggle_ai', methods=['POST'])
@@ -634,11 +3381,175 @@ def api_admin_toggle_ai():
     write_settings(s)
     return jsonify({"ok": True, "allow_external_queries": s['allow_external_queries']})
 
-if __name__ == '__main__':
-    # Ensure logs file exists
-    if not os.path.exists(CHAT_LOG_FILE):
-        with open(CHAT_LOG_FILE, 'w') as f:
-            json.dump([], f)
+# Request timing, the slow-request log and the sampling profiler hook. Requests slower than
+# SLOW_REQUEST_MS (0 = off) are logged with their per-stage breakdown. A PROFILE_SAMPLE_RATE
+# share of requests run under cProfile; if such a request is slow its profile is handed to
+# every callable in SLOW_REQUEST_HOOKS (the default prints the top functions).
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '0'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+def _print_profile(info):
+    prof = info.get('profile')
+    if prof is None:
+        return
+    buf = io.StringIO()
+    pstats.Stats(prof, stream=buf).sort_stats('cumulative').print_stats(15)
+    print(buf.getvalue())
+
+SLOW_REQUEST_HOOKS = [_print_profile]
+
+@app.before_request
+def _start_request_timer():
+    g.t0 = time.perf_counter()
+    g.stages = []
+    g.profile = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+@app.after_request
+def _record_request_time(response):
+    # streamed bodies are still being generated here: timed_stream() records those at the end
+    if not getattr(g, 'streaming', False):
+        _observe_request()
+    return response
+
+def timed_stream(events):
+    """Wrap a streamed response body so the request is timed (and logged if slow) once the
+    last event is sent or the client goes away, not when the headers go out."""
+    g.streaming = True
+    return _observe_after(events)
+
+def _observe_after(events):
+    try:
+        yield from events
+    finally:
+        _observe_request()
+
+def _observe_request():
+    t0 = getattr(g, 't0', None)
+    if t0 is None:
+        return
+    dt = time.perf_counter() - t0
+    prof = getattr(g, 'profile', None)
+    if prof is not None:
+        prof.disable()
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.observe('mmec_request_seconds', dt, endpoint=endpoint, method=request.method)
+    if SLOW_REQUEST_MS and dt * 1000 >= SLOW_REQUEST_MS:
+        METRICS.inc('mmec_slow_requests_total', endpoint=endpoint)
+        stages = ', '.join(f'{name}={secs * 1000:.1f}ms' for name, secs in g.stages)
+        print(f'Slow request {request.method} {request.path} {dt * 1000:.1f}ms [{stages}]')
+        info = {'method': request.method, 'path': request.path, 'seconds': dt, 'stages': list(g.stages), 'profile': prof}
+        for hook in SLOW_REQUEST_HOOKS:
+            try:
+                hook(info)
+            except Exception as e:
+                print('slow request hook error', e)
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus text exposition of this process's metrics."""
+    cache = AI_CACHE.stats()
+    sf = SINGLE_FLIGHT.stats()
+    gauges = [
+        ('mmec_ai_cache_hit_ratio', 'AI response cache hit ratio', {}, round(cache['hit_rate'], 6)),
+        ('mmec_ai_cache_entries', 'AI response cache entries in memory', {}, cache['size']),
+        ('mmec_ai_singleflight_in_flight', 'Provider calls currently shared by single-flight', {}, sf['in_flight']),
+    ]
+    for p in PROVIDERS.providers:
+        gauges.append(('mmec_provider_breaker_open', '1 if the provider circuit breaker is not closed',
+                       {'provider': p.name}, 0 if p.breaker.state == 'closed' else 1))
+    return Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/ai_cache', methods=['GET','DELETE'])
+def api_admin_ai_cache():
+    """AI response cache stats (GET) or clear it (DELETE), e.g. after college data changes.
+    Requires header: X-Session-Token: <token> or ?token= in querystring. Only Admin may call.
+    """
+    token = request.headers.get('X-Session-Token') or request.args.get('token')
+    user = SESSIONS.get(token)
+    if not user or user != 'Admin':
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    if request.method == 'DELETE':
+        cleared = AI_CACHE.clear()
+        return jsonify({"ok": True, "cleared": cleared})
+    return jsonify({"ok": True, "cache": AI_CACHE.stats()})
+
+# Process lifecycle. preload() does all the expensive start-up work once; under a pre-forking
+# server (see wsgi.py) it runs in the master so every worker shares the FAQ automaton, the
+# college index and the provider clients copy-on-write. shutdown() stops taking traffic, waits
+# up to `drain` seconds for in-flight requests and then flushes queued history writes and the
+# chat log. /healthz is liveness (the process answers), /readyz is readiness (preloaded and
+# not draining).
+_LIFECYCLE = {'ready': False, 'draining': False, 'inflight': 0}
+_LIFECYCLE_COND = threading.Condition()
+
+def preload():
+    # Ensure logs file exists (upgrades a legacy chat_logs.json on first run)
+    LOGS._open()
     # Ensure users file exists (loaded by load_users)
-    _ = load_users()
+    load_users()
+    get_college_index()
+    get_structured_data()
+    get_fuzzy_vocab()
+    # import/configure AI clients now rather than on the first user question
+    PROVIDERS.warm()
+    # connections opened by the schema check must not be shared with forked workers
+    DB.close_all()
+    _LIFECYCLE['ready'] = True
+    return app
+
+def begin_drain():
+    """Fail /readyz from now on so load balancers stop routing here; requests are still served."""
+    with _LIFECYCLE_COND:
+        _LIFECYCLE['draining'] = True
+
+def shutdown(drain=10.0):
+    begin_drain()
+    with _LIFECYCLE_COND:
+        deadline = time.monotonic() + drain
+        while _LIFECYCLE['inflight'] > 0:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                print('shutdown: giving up on', _LIFECYCLE['inflight'], 'in-flight requests')
+                break
+            _LIFECYCLE_COND.wait(left)
+    try:
+        HISTORY_WRITER.flush()
+    except Exception as e:
+        print('shutdown: history flush error', e)
+    LOGS.flush()
+    DB.close_all()
+
+@app.before_request
+def _track_inflight():
+    with _LIFECYCLE_COND:
+        _LIFECYCLE['inflight'] += 1
+
+@app.teardown_request
+def _untrack_inflight(exc=None):
+    with _LIFECYCLE_COND:
+        _LIFECYCLE['inflight'] -= 1
+        _LIFECYCLE_COND.notify_all()
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"ok": True, "pid": os.getpid()})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    status = {
+        "ready": _LIFECYCLE['ready'] and not _LIFECYCLE['draining'],
+        "preloaded": _LIFECYCLE['ready'],
+        "draining": _LIFECYCLE['draining'],
+        "inflight": _LIFECYCLE['inflight'] - 1,
+        "db": db_available(),
+        "providers": [p.name for p in PROVIDERS.available()],
+    }
+    return jsonify(status), (200 if status['ready'] else 503)
+
+if __name__ == '__main__':
+    # development server; use wsgi.py (gunicorn/waitress) in production
+    preload()
     app.run(host='0.0.0.0', port=5000, debug=True)
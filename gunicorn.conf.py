@@ -0,0 +1,40 @@
+"""
+gunicorn settings for wsgi:application (see wsgi.py).
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(multiprocessing.cpu_count(), 8))))
+threads = int(os.getenv('WEB_THREADS', '8'))
+worker_class = 'gthread'
+# build indexes and provider clients once in the master; workers inherit them copy-on-write
+preload_app = True
+# SIGTERM: stop accepting, let in-flight requests finish for up to this long, then exit
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+# streaming answers can legitimately take as long as the AI deadline
+timeout = int(os.getenv('WORKER_TIMEOUT', '60'))
+keepalive = 5
+accesslog = os.getenv('ACCESS_LOG') or None
+
+
+def post_worker_init(worker):
+    # gunicorn drains on SIGTERM before any exit hook runs: mark the worker as draining
+    # (so /readyz answers 503) first, then hand over to gunicorn's own handler
+    import signal
+    from app import begin_drain
+    graceful = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        begin_drain()
+        if callable(graceful):
+            graceful(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    # runs in the worker after gunicorn has drained its requests: write out anything queued
+    from app import shutdown
+    shutdown(drain=0)
@@ -0,0 +1,99 @@
+"""
+Benchmark the typo-tolerant matcher (FuzzyVocab in app.py) as its vocabulary grows.
+Usage:
+    python scripts/bench_fuzzy.py [--sizes 1000,10000,50000] [--lookups 20000] [--out fuzzy_results.json]
+
+This script will:
+ - build the real vocabulary (FAQ triggers + college data) from a scratch copy of the data
+ - pad it with random synthetic words up to each --sizes value and build the deletion index
+ - look up misspellings (one or two edits) of real and synthetic words, plus unknown words
+ - print build time, index entries and microseconds per lookup for each size, and write JSON
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import string
+import argparse
+
+from benchmark import ROOT, build_workspace
+
+
+def misspell(word, rnd):
+    """Apply one random edit (or two for long words)."""
+    for _ in range(1 if len(word) < 7 else 2):
+        i = rnd.randrange(len(word))
+        op = rnd.choice('dist')
+        c = rnd.choice(string.ascii_lowercase)
+        if op == 'd' and len(word) > 1:
+            word = word[:i] + word[i + 1:]
+        elif op == 'i':
+            word = word[:i] + c + word[i:]
+        elif op == 's':
+            word = word[:i] + c + word[i + 1:]
+        elif i + 1 < len(word):
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fuzzy vocabulary index')
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='fuzzy_results.json')
+    args = parser.parse_args()
+
+    work = build_workspace(0, [])
+    try:
+        os.chdir(work)
+        sys.path.insert(0, ROOT)
+        import app as mmec
+        base = dict(mmec.get_fuzzy_vocab().counts)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+
+    rnd = random.Random(args.seed)
+    results = {"base_vocabulary": len(base), "runs": {}}
+    real_words = [w for w in base if len(w) >= mmec.FUZZY_MIN_LEN]
+    print('%10s %10s %12s %10s %12s %8s' % ('vocab', 'build s', 'index keys', 'us/lookup', 'us/miss', 'fixed'))
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        counts = dict(base)
+        while len(counts) < size:
+            w = ''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 12)))
+            counts.setdefault(w, 1)
+        t0 = time.perf_counter()
+        fv = mmec.FuzzyVocab(counts)
+        build = time.perf_counter() - t0
+
+        pool = real_words + rnd.sample(list(counts), min(len(counts), 1000))
+        targets = [rnd.choice(pool) for _ in range(args.lookups)]
+        typos = [misspell(w, rnd) for w in targets]
+        t0 = time.perf_counter()
+        fixed = sum(1 for typo, w in zip(typos, targets) if (fv.correct(typo) or (None,))[0] == w)
+        per_lookup = (time.perf_counter() - t0) / len(typos) * 1e6
+
+        misses = [''.join(rnd.choice('qxzj') for _ in range(rnd.randint(5, 10))) for _ in range(args.lookups // 10 or 1)]
+        t0 = time.perf_counter()
+        for m in misses:
+            fv.correct(m)
+        per_miss = (time.perf_counter() - t0) / len(misses) * 1e6
+
+        run = {"vocabulary": len(counts), "build_seconds": round(build, 3), "index_keys": len(fv.index),
+               "us_per_lookup": round(per_lookup, 2), "us_per_miss": round(per_miss, 2),
+               "corrected_to_original": round(fixed / len(typos), 4)}
+        results['runs'][str(size)] = run
+        print('%10d %10.2f %12d %10.1f %12.1f %7.1f%%' % (len(counts), build, len(fv.index), per_lookup, per_miss,
+                                                          run['corrected_to_original'] * 100))
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('Saved results to', args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
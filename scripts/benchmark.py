@@ -0,0 +1,322 @@
+"""
+Replay real chat traffic against the backend and report throughput and latency.
+Usage:
+    python scripts/benchmark.py [--requests N] [--concurrency C] [--sizes 0,10000]
+                                [--stub-latency-ms MS] [--stub-error-rate R]
+                                [--server http://127.0.0.1:5000] [--out results.json]
+                                [--compare previous.json]
+
+This script will:
+ - collect the questions asked in chat_logs.json(l) and data/histories/*.json(l)
+ - copy the project data into a scratch directory (the real files are never touched) and,
+   for every --sizes value, inflate each user's history and the chat log by that many
+   synthetic entries
+ - run the Flask app in-process (test client) with the stub AI provider, or drive an
+   already running server when --server is given (then --sizes is ignored)
+ - send a weighted mix of /api/query, /api/history GET/POST and /api/logs requests from
+   C concurrent workers and print requests/s and p50/p95/p99 latency per endpoint
+ - write the results as JSON; --compare prints the change against an earlier run and
+   exits with status 2 when a p95 regressed by more than --threshold percent
+
+Each data size runs in its own child process so the app starts cold on its own copy.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from glob import glob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# endpoint name -> share of the traffic mix
+MIX = [('query', 0.6), ('history_get', 0.15), ('history_post', 0.15), ('logs', 0.1)]
+USERS = ['Student', 'Faculty', 'Admin']
+FALLBACK_QUESTIONS = ['what are the fees', 'hostel facilities', 'library timings', 'who is the principal',
+                      'placement record', 'is ragging permitted', 'weather today', 'bus routes']
+
+
+def load_questions():
+    """Every user message found in the chat log and the saved histories."""
+    questions = []
+    for path in (os.path.join(ROOT, 'chat_logs.jsonl'), os.path.join(ROOT, 'chat_logs.json')):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                entries = [json.loads(ln) for ln in f if ln.strip()]
+            else:
+                entries = json.load(f)
+        questions += [e.get('user_msg') for e in entries if isinstance(e, dict)]
+        break
+    for path in glob(os.path.join(ROOT, 'data', 'histories', '*.json*')):
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                items = [json.loads(ln) for ln in f if ln.strip()]
+            else:
+                items = json.load(f)
+        questions += [it.get('text') for it in items if isinstance(it, dict) and it.get('from') == 'user']
+    questions = [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+    return questions or FALLBACK_QUESTIONS
+
+
+def build_workspace(size, questions):
+    """Copy the app's data into a temp dir and pad histories/logs with `size` synthetic entries."""
+    work = tempfile.mkdtemp(prefix='mmec-bench-')
+    for name in ('index.html', 'users.json', 'chat_logs.json', 'chat_logs.jsonl'):
+        if os.path.exists(os.path.join(ROOT, name)):
+            shutil.copy2(os.path.join(ROOT, name), work)
+    shutil.copytree(os.path.join(ROOT, 'data'), os.path.join(work, 'data'),
+                    ignore=shutil.ignore_patterns('mmec.db-wal', 'mmec.db-shm', '*.lock', '*.idx'))
+    if not size:
+        return work
+    rnd = random.Random(size)
+    hist_dir = os.path.join(work, 'data', 'histories')
+    os.makedirs(hist_dir, exist_ok=True)
+    for user in USERS:
+        # the server upgrades a plain .json history to .jsonl on first touch; write .jsonl directly
+        path = os.path.join(hist_dir, user + '.jsonl')
+        legacy = os.path.join(hist_dir, user + '.json')
+        with open(path, 'a', encoding='utf-8') as out:
+            if os.path.exists(legacy) and not os.path.getsize(path):
+                with open(legacy, 'r', encoding='utf-8') as f:
+                    for it in json.load(f):
+                        out.write(json.dumps(it, ensure_ascii=False) + '\n')
+                os.replace(legacy, legacy + '.bak')
+            for i in range(size):
+                who = 'user' if i % 2 == 0 else 'bot'
+                out.write(json.dumps({"from": who, "text": rnd.choice(questions), "ts": "2025-01-01T00:00:00Z"}) + '\n')
+    log_path = os.path.join(work, 'chat_logs.jsonl')
+    legacy_log = os.path.join(work, 'chat_logs.json')
+    with open(log_path, 'a', encoding='utf-8') as out:
+        if os.path.exists(legacy_log) and not os.path.getsize(log_path):
+            with open(legacy_log, 'r', encoding='utf-8') as f:
+                for e in json.load(f):
+                    out.write(json.dumps(e, ensure_ascii=False) + '\n')
+        for i in range(size):
+            out.write(json.dumps({"ts": "2025-01-01T00:00:00Z", "user": rnd.choice(USERS),
+                                  "user_msg": rnd.choice(questions), "bot_msg": "synthetic"}) + '\n')
+    return work
+
+
+def make_request(kind, rnd, questions):
+    """(method, path, json body) for one request of the given kind."""
+    user = rnd.choice(USERS)
+    if kind == 'query':
+        return 'POST', '/api/query', {"message": rnd.choice(questions), "role": user}
+    if kind == 'history_get':
+        return 'GET', '/api/history?user=%s&size=20' % user, None
+    if kind == 'history_post':
+        return 'POST', '/api/history', {"user": user, "from": "user", "text": rnd.choice(questions)}
+    return 'GET', '/api/logs?limit=50', None
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(round(pct / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(samples, wall):
+    """samples: kind -> [(seconds, ok)] -> per-endpoint stats in milliseconds."""
+    report = {}
+    total = 0
+    for kind, vals in sorted(samples.items()):
+        lat = sorted(v[0] * 1000 for v in vals)
+        total += len(vals)
+        report[kind] = {
+            "count": len(vals),
+            "errors": sum(1 for v in vals if not v[1]),
+            "rps": round(len(vals) / wall, 1) if wall else 0.0,
+            "mean_ms": round(sum(lat) / len(lat), 3) if lat else 0.0,
+            "p50_ms": round(percentile(lat, 50), 3),
+            "p95_ms": round(percentile(lat, 95), 3),
+            "p99_ms": round(percentile(lat, 99), 3),
+        }
+    report["_total"] = {"count": total, "seconds": round(wall, 3), "rps": round(total / wall, 1) if wall else 0.0}
+    return report
+
+
+def run_load(send, questions, n_requests, concurrency, seed):
+    """Drive `send(method, path, body) -> ok` from `concurrency` threads."""
+    kinds = [k for k, _ in MIX]
+    weights = [w for _, w in MIX]
+    samples = {k: [] for k in kinds}
+    lock = threading.Lock()
+    counter = iter(range(n_requests))
+
+    def worker(wid):
+        rnd = random.Random(seed * 1000 + wid)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            kind = rnd.choices(kinds, weights)[0]
+            method, path, body = make_request(kind, rnd, questions)
+            t0 = time.perf_counter()
+            try:
+                ok = send(method, path, body)
+            except Exception:
+                ok = False
+            dt = time.perf_counter() - t0
+            with lock:
+                samples[kind].append((dt, ok))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - t0)
+
+
+def http_sender(base):
+    base = base.rstrip('/')
+
+    def send(method, path, body):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(base + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return 200 <= resp.status < 300
+    return send
+
+
+def run_in_process(args, questions):
+    """Child mode: build a workspace for args.size, import the app there and run the load."""
+    work = build_workspace(args.size, questions)
+    try:
+        os.chdir(work)
+        os.environ['AI_PROVIDER'] = 'stub'
+        os.environ['AI_STUB_LATENCY_MS'] = str(args.stub_latency_ms)
+        os.environ['AI_STUB_ERROR_RATE'] = str(args.stub_error_rate)
+        sys.path.insert(0, ROOT)
+        import app as mmec
+        mmec.LOGS._open()
+        mmec.load_users()
+        client = mmec.app.test_client()
+
+        def send(method, path, body):
+            resp = client.open(path, method=method, json=body)
+            resp.get_data()
+            return 200 <= resp.status_code < 300
+
+        # warm-up: build the FAQ/college indexes and open the stores outside the timing
+        for kind, _ in MIX:
+            send(*make_request(kind, random.Random(0), questions))
+        report = run_load(send, questions, args.requests, args.concurrency, args.seed)
+        mmec.HISTORY_WRITER.flush()
+        mmec.LOGS.flush()
+        return report
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def print_report(label, report):
+    print('\n==', label, '==')
+    print('%-14s %7s %6s %9s %9s %9s %9s' % ('endpoint', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for kind, st in report.items():
+        if kind.startswith('_'):
+            continue
+        print('%-14s %7d %6d %9.1f %9.2f %9.2f %9.2f' % (kind, st['count'], st['errors'], st['rps'],
+                                                          st['p50_ms'], st['p95_ms'], st['p99_ms']))
+    tot = report['_total']
+    print('total: %d requests in %.2fs (%.1f req/s)' % (tot['count'], tot['seconds'], tot['rps']))
+
+
+def compare(current, previous, threshold):
+    """Print p95 deltas per run/endpoint; return True if any exceeded the threshold."""
+    regressed = False
+    prev_runs = previous.get('runs', {})
+    print('\n== comparison (p95) ==')
+    for label, report in current['runs'].items():
+        old = prev_runs.get(label)
+        if not old:
+            continue
+        for kind, st in report.items():
+            if kind.startswith('_') or kind not in old:
+                continue
+            before, after = old[kind]['p95_ms'], st['p95_ms']
+            change = ((after - before) / before * 100.0) if before else 0.0
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressed = True
+            print('%-12s %-14s %9.2f -> %9.2f ms (%+.1f%%)%s' % (label, kind, before, after, change, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--sizes', default='0,10000', help='comma separated synthetic entries per history/log')
+    parser.add_argument('--stub-latency-ms', type=float, default=50.0)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--server', help='benchmark a running server at this URL instead of in-process')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=20.0, help='p95 regression threshold in percent')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--child-out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    questions = load_questions()
+    if args.child_out:
+        with open(args.child_out, 'w', encoding='utf-8') as f:
+            json.dump(run_in_process(args, questions), f)
+        return 0
+
+    results = {
+        "started": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "seed": args.seed,
+                   "stub_latency_ms": args.stub_latency_ms, "stub_error_rate": args.stub_error_rate,
+                   "server": args.server, "mix": dict(MIX), "questions": len(questions)},
+        "runs": {},
+    }
+    if args.server:
+        report = run_load(http_sender(args.server), questions, args.requests, args.concurrency, args.seed)
+        results['runs']['server'] = report
+        print_report('server ' + args.server, report)
+    else:
+        for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            fd, child_out = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+            try:
+                cmd = [sys.executable, os.path.abspath(__file__), '--size', str(size), '--child-out', child_out,
+                       '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                       '--seed', str(args.seed), '--stub-latency-ms', str(args.stub_latency_ms),
+                       '--stub-error-rate', str(args.stub_error_rate)]
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+                with open(child_out, 'r', encoding='utf-8') as f:
+                    report = json.load(f)
+            finally:
+                os.remove(child_out)
+            label = 'size=%d' % size
+            results['runs'][label] = report
+            print_report(label, report)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('\nSaved results to', args.out)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if compare(results, previous, args.threshold):
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
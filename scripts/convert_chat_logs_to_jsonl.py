@@ -0,0 +1,39 @@
+"""
+Convert the legacy chat_logs.json array into the append-only chat_logs.jsonl file.
+Usage:
+    python scripts/convert_chat_logs_to_jsonl.py [--force]
+
+This script will:
+ - read chat_logs.json (a single JSON array) from the project root
+ - write one JSON object per line to chat_logs.jsonl (via a temp file + rename)
+ - refuse to overwrite an existing chat_logs.jsonl unless --force is given
+
+The server performs the same conversion automatically the first time it opens the
+log when chat_logs.jsonl is missing; run this to do it ahead of time.
+"""
+import os
+import sys
+import json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'chat_logs.json')
+DEST = os.path.join(ROOT, 'chat_logs.jsonl')
+
+if not os.path.exists(SRC):
+    print('No legacy log file at', SRC)
+    sys.exit(0)
+if os.path.exists(DEST) and '--force' not in sys.argv:
+    print(DEST, 'already exists; pass --force to overwrite it')
+    sys.exit(1)
+
+with open(SRC, 'r', encoding='utf-8') as f:
+    logs = json.load(f)
+
+tmp = DEST + '.tmp'
+with open(tmp, 'w', encoding='utf-8') as f:
+    for entry in logs:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+os.replace(tmp, DEST)
+print('Converted', len(logs), 'log entries into', DEST)
@@ -1,84 +1,340 @@
 """
-Migrate JSON histories and settings into a single SQLite database (data/mmec.db).
+Migrate JSON histories, chat logs, users and settings into a single SQLite database (data/mmec.db).
 Usage:
-    python scripts/migrate_histories_to_sqlite.py
+    python scripts/migrate_histories_to_sqlite.py [--batch N] [--reset]
 
 This script will:
  - create data/mmec.db if missing
- - create tables: users, histories, settings
- - import JSON files from data/histories/*.json
- - import data/settings.json if present
+ - create tables: users, histories, chat_logs, settings, migration_sources
+ - stream history files from data/histories/*.json and *.jsonl, chat_logs.jsonl (or the
+   legacy chat_logs.json) and import them with executemany in transactions of --batch rows
+ - import users.json (passwords are stored hashed) and data/settings.json
+ - create the indexes after the bulk load and print rows/s per source
+
+Only the histories table is served by the app (it switches /api/history to data/mmec.db once
+the table exists). users, chat_logs and settings are a one-way export for reporting and
+inspection: login still reads users.json, logs are still written to chat_logs.jsonl and
+settings to data/settings.json, so re-run the script to refresh those copies.
+
+It is safe to re-run: every source file has a high-water mark (the byte offset just past
+the last imported record, plus a hash of the file's first 4 KB, or of everything before the
+mark if that is shorter) saved in the same transaction as its rows, so a re-run only imports
+records appended since, and an interrupted run resumes where it stopped. A file that shrank
+below its mark or whose start changed (cleared or rewritten) is skipped with a warning; --reset forgets all marks, so the next run
+imports every file again (delete data/mmec.db first to avoid duplicates).
 
 After running, you can open the DB with the sqlite3 CLI or tools like DB Browser for SQLite.
 """
 import os
+import sys
 import json
+import time
+import hashlib
 import sqlite3
+import argparse
 from glob import glob
 
-ROOT = os.path.dirname(os.path.dirname(__file__))
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(ROOT, 'data')
 DB_PATH = os.path.join(DATA_DIR, 'mmec.db')
 HIST_DIR = os.path.join(DATA_DIR, 'histories')
 
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(HIST_DIR, exist_ok=True)
-
-conn = sqlite3.connect(DB_PATH)
-c = conn.cursor()
-
-# Create tables
-c.execute('''CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE,
-    role TEXT,
-    extra TEXT
-)''')
-
-c.execute('''CREATE TABLE IF NOT EXISTS histories (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT,
-    role TEXT,
-    sender TEXT,
-    text TEXT,
-    ts TEXT
-)''')
-
-c.execute('''CREATE TABLE IF NOT EXISTS settings (
-    key TEXT PRIMARY KEY,
-    value TEXT
-)''')
-
-conn.commit()
-
-# Import histories
-count = 0
-for path in glob(os.path.join(HIST_DIR, '*.json')):
+# bytes hashed to recognise that the imported prefix of a source is unchanged
+FINGERPRINT_BYTES = 4096
+READ_CHUNK = 1 << 20
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        role TEXT,
+        extra TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS histories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        role TEXT,
+        sender TEXT,
+        text TEXT,
+        ts TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS chat_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT,
+        user TEXT,
+        user_msg TEXT,
+        bot_msg TEXT,
+        extra TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS migration_sources (
+        source TEXT PRIMARY KEY,
+        offset INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        rows INTEGER NOT NULL
+    )''',
+)
+
+INDEXES = (
+    # Keyset pagination in /api/history seeks on (username, id)
+    'CREATE INDEX IF NOT EXISTS idx_histories_username_id ON histories (username, id)',
+    'CREATE INDEX IF NOT EXISTS idx_chat_logs_ts ON chat_logs (ts)',
+    'CREATE INDEX IF NOT EXISTS idx_chat_logs_user ON chat_logs (user)',
+)
+
+
+def fingerprint(path, end):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(end, FINGERPRINT_BYTES))).hexdigest()
+
+
+def iter_jsonl(path, start):
+    """Yield (record, end_offset) for each complete line after byte `start`."""
+    pos = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break   # torn/in-progress last line: leave it for the next run
+            pos += len(line)
+            if line.strip():
+                yield json.loads(line), pos
+
+
+def iter_json_array(path, start):
+    """Yield (record, end_offset) for each element of a JSON array file, without loading it
+    whole. `start` is 0 or an offset previously returned (just past an element)."""
+    decoder = json.JSONDecoder()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        buf = ''
+        pos = start         # byte offset of buf[0]
+        opened = start > 0
+        eof = False
+        while True:
+            i = 0
+            while i < len(buf) and buf[i] in ' \t\r\n,[':
+                if buf[i] == '[':
+                    if opened:
+                        raise ValueError('unexpected [ between elements')
+                    opened = True
+                i += 1
+            if i:
+                pos += len(buf[:i].encode('utf-8'))
+                buf = buf[i:]
+            if buf.startswith(']'):
+                return
+            if buf:
+                end = None
+                try:
+                    item, end = decoder.raw_decode(buf)
+                except ValueError:
+                    if eof:
+                        raise
+                if end is not None and (end < len(buf) or eof):
+                    pos += len(buf[:end].encode('utf-8'))
+                    buf = buf[end:]
+                    yield item, pos
+                    continue
+            if eof:
+                return
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                eof = True
+                continue
+            # keep a split multi-byte character for the next read
+            while True:
+                try:
+                    buf += chunk.decode('utf-8')
+                    break
+                except UnicodeDecodeError:
+                    more = f.read(1)
+                    if not more:
+                        raise
+                    chunk += more
+
+
+def history_row(name, item):
+    return (name, item.get('role') or name, item.get('from') or item.get('sender') or 'user',
+            item.get('text') or item.get('message') or '', item.get('ts') or item.get('timestamp') or '')
+
+
+def log_row(name, item):
+    extra = {k: v for k, v in item.items() if k not in ('ts', 'user', 'user_msg', 'bot_msg')}
+    return (item.get('ts', ''), item.get('user', 'Guest'), item.get('user_msg', ''), item.get('bot_msg', ''),
+            json.dumps(extra, ensure_ascii=False) if extra else None)
+
+
+HISTORY_INSERT = 'INSERT INTO histories (username, role, sender, text, ts) VALUES (?,?,?,?,?)'
+LOG_INSERT = 'INSERT INTO chat_logs (ts, user, user_msg, bot_msg, extra) VALUES (?,?,?,?,?)'
+
+
+def import_source(conn, path, name, insert_sql, to_row, batch):
+    """Stream one file into the DB from its high-water mark. Returns rows imported."""
+    source = os.path.relpath(path, ROOT).replace(os.sep, '/')
+    mark = conn.execute('SELECT offset, fingerprint, rows FROM migration_sources WHERE source = ?', (source,)).fetchone()
+    start, total, skip = 0, 0, 0
+    if mark:
+        start, fp, total = mark
+        if os.path.getsize(path) < start or fingerprint(path, start) != fp:
+            print('  skip %s: changed since it was imported (see --reset)' % source)
+            return 0
+    elif source.endswith('.jsonl'):
+        # the server converts X.json to X.jsonl in order; skip what was imported from X.json
+        legacy = conn.execute('SELECT rows FROM migration_sources WHERE source = ?', (source[:-1],)).fetchone()
+        if legacy:
+            skip = total = legacy[0]
+    records = iter_jsonl(path, start) if path.endswith('.jsonl') else iter_json_array(path, start)
+    rows, imported, end = [], 0, start
+
+    def commit():
+        nonlocal rows, imported
+        with conn:
+            conn.executemany(insert_sql, rows)
+            conn.execute('INSERT OR REPLACE INTO migration_sources (source, offset, fingerprint, rows) VALUES (?,?,?,?)',
+                         (source, end, fingerprint(path, end), total + imported + len(rows)))
+        imported += len(rows)
+        rows = []
+
+    for item, end in records:
+        if skip:
+            skip -= 1
+            continue
+        if isinstance(item, dict):
+            rows.append(to_row(name, item))
+        if len(rows) >= batch:
+            commit()
+    if rows or end != start:
+        commit()
+    return imported
+
+
+def hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 200000)
+    return 'pbkdf2_sha256$200000$%s$%s' % (salt.hex(), digest.hex())
+
+
+def import_users(conn):
+    path = os.path.join(ROOT, 'users.json')
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        users = json.load(f)
+    rows = []
+    for username, password in users.items():
+        old = conn.execute('SELECT extra FROM users WHERE username = ?', (username,)).fetchone()
+        extra = json.loads(old[0]) if old and old[0] else {}
+        if not extra.get('password_hash') or not check_password(password, extra['password_hash']):
+            extra['password_hash'] = hash_password(password)
+        rows.append((username, username, json.dumps(extra)))
+    with conn:
+        conn.executemany('INSERT INTO users (username, role, extra) VALUES (?,?,?) '
+                         'ON CONFLICT(username) DO UPDATE SET role = excluded.role, extra = excluded.extra', rows)
+    return len(rows)
+
+
+def check_password(password, stored):
     try:
+        _, iterations, salt, digest = stored.split('$')
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations)).hex() == digest
+    except ValueError:
+        return False
+
+
+def import_settings(conn):
+    settings_path = os.path.join(DATA_DIR, 'settings.json')
+    if not os.path.exists(settings_path):
+        return 0
+    with open(settings_path, 'r', encoding='utf-8') as f:
+        s = json.load(f)
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?,?)',
+                         [(k, json.dumps(v)) for k, v in s.items()])
+    return len(s)
+
+
+def report(label, rows, seconds):
+    rate = rows / seconds if seconds > 0 else 0.0
+    print('  %-36s %9d rows %8.2fs %11.0f rows/s' % (label, rows, seconds, rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate JSON data into data/mmec.db')
+    parser.add_argument('--batch', type=int, default=10000, help='rows per transaction')
+    parser.add_argument('--reset', action='store_true', help='forget the per-file high-water marks')
+    args = parser.parse_args()
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(HIST_DIR, exist_ok=True)
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    with conn:
+        for sql in SCHEMA:
+            conn.execute(sql)
+        if args.reset:
+            conn.execute('DELETE FROM migration_sources')
+
+    started = time.perf_counter()
+    totals = {'histories': 0, 'chat_logs': 0}
+
+    # The server's JSON fallback writes <user>.jsonl (one item per line); older installs have <user>.json arrays
+    print('histories:')
+    for path in sorted(glob(os.path.join(HIST_DIR, '*.json')) + glob(os.path.join(HIST_DIR, '*.jsonl'))):
         name = os.path.splitext(os.path.basename(path))[0]
-        with open(path, 'r', encoding='utf-8') as f:
-            lst = json.load(f)
-        for item in lst:
-            sender = item.get('from') or item.get('sender') or 'user'
-            text = item.get('text') or item.get('message') or ''
-            ts = item.get('ts') or item.get('timestamp') or ''
-            role = item.get('role') or name
-            c.execute('INSERT INTO histories (username, role, sender, text, ts) VALUES (?,?,?,?,?)', (name, role, sender, text, ts))
-            count += 1
-    except Exception as e:
-        print('Failed to import', path, e)
+        t0 = time.perf_counter()
+        try:
+            n = import_source(conn, path, name, HISTORY_INSERT, history_row, args.batch)
+        except Exception as e:
+            print('Failed to import', path, e)
+            continue
+        totals['histories'] += n
+        report(os.path.basename(path), n, time.perf_counter() - t0)
+
+    print('chat logs:')
+    log_path = os.path.join(ROOT, 'chat_logs.jsonl')
+    if not os.path.exists(log_path):
+        log_path = os.path.join(ROOT, 'chat_logs.json')
+    if os.path.exists(log_path):
+        t0 = time.perf_counter()
+        try:
+            totals['chat_logs'] = import_source(conn, log_path, None, LOG_INSERT, log_row, args.batch)
+            report(os.path.basename(log_path), totals['chat_logs'], time.perf_counter() - t0)
+        except Exception as e:
+            print('Failed to import', log_path, e)
 
-# Import settings.json
-settings_path = os.path.join(DATA_DIR, 'settings.json')
-if os.path.exists(settings_path):
     try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            s = json.load(f)
-        for k, v in s.items():
-            c.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?,?)', (k, json.dumps(v)))
+        n_users = import_users(conn)
+    except Exception as e:
+        print('Failed to import users', e)
+        n_users = 0
+    try:
+        n_settings = import_settings(conn)
     except Exception as e:
         print('Failed to import settings', e)
+        n_settings = 0
+
+    # indexes last: building them once over the loaded rows is cheaper than maintaining them per insert
+    t0 = time.perf_counter()
+    with conn:
+        for sql in INDEXES:
+            conn.execute(sql)
+    index_seconds = time.perf_counter() - t0
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    rows = totals['histories'] + totals['chat_logs']
+    print('Imported %d history rows, %d chat log rows, %d users and %d settings into %s'
+          % (totals['histories'], totals['chat_logs'], n_users, n_settings, DB_PATH))
+    print('%.2fs total (%.0f rows/s, indexes %.2fs)' % (elapsed, rows / elapsed if elapsed > 0 else 0.0, index_seconds))
+    return 0
+
 
-conn.commit()
-conn.close()
-print('Imported', count, 'history rows into', DB_PATH)
+if __name__ == '__main__':
+    sys.exit(main())
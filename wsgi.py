@@ -0,0 +1,51 @@
+"""
+Production entry point for the MMEC chatbot backend.
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:application     (Linux/macOS: pre-forked workers x threads)
+    python wsgi.py                                    (any OS, Windows included: waitress, threads)
+
+Importing this module runs app.preload(): the chat log and users file are opened, the FAQ
+automaton and college-data index are built and the AI provider clients are created. With
+gunicorn's preload_app this happens once in the master, before the workers fork, so they
+share that memory copy-on-write and the first question doesn't pay for it.
+
+Settings (environment):
+    BIND             address:port to listen on (default 0.0.0.0:5000)
+    WEB_CONCURRENCY  gunicorn worker processes (default: CPU count, at most 8)
+    WEB_THREADS      threads per worker / waitress threads (default 8)
+    GRACEFUL_TIMEOUT seconds to drain in-flight requests on shutdown (default 30)
+
+Probes: GET /healthz (liveness) and GET /readyz (readiness; 503 while draining).
+"""
+import os
+import signal
+import sys
+
+from app import begin_drain, preload, shutdown
+
+application = preload()
+
+BIND = os.getenv('BIND', '0.0.0.0:5000')
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+GRACEFUL_TIMEOUT = float(os.getenv('GRACEFUL_TIMEOUT', '30'))
+
+
+def _stop(signum, frame):
+    begin_drain()
+    raise SystemExit(0)
+
+
+if __name__ == '__main__':
+    try:
+        from waitress import serve
+    except ImportError:
+        print('waitress is not installed: pip install waitress (or run gunicorn -c gunicorn.conf.py wsgi:application)')
+        sys.exit(1)
+    host, _, port = BIND.rpartition(':')
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        serve(application, host=host or '0.0.0.0', port=int(port), threads=WEB_THREADS)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        shutdown(drain=GRACEFUL_TIMEOUT)